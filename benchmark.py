@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for emlgo.
+
+Generates a synthetic .eml corpus, times every stage of the conversion
+(eml_to_html, anonymizer, add_href_to_anchor_tags, remove_scripts and every
+installed sanitizer, the fused GophishTransformer, the near-duplicate
+clustering, the end-to-end gophishing_everything, emls_to_htmls with an
+asset store and the conversion of the corpus written as an mbox) and the
+CampaignManager upload paths against a local stub Gophish server, and
+writes the results as JSON.
+
+    python benchmark.py --emails 500 --names 2000 --output before.json
+    python benchmark.py --emails 500 --names 2000 --output after.json --compare before.json
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import posixpath
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import dedupe
+from emlgolib import (AssetStore, GophishTransformer, NameMatcher, add_href_to_anchor_tags, anonymizer,
+                      available_sanitizers, eml_to_html, emls_to_htmls, find_eml_files, gophishing_everything,
+                      remove_scripts, sanitize_html)
+
+SYLLABLES = ['ma', 'ri', 'o', 'lu', 'gi', 'an', 'na', 'pa', 'ol', 'ro', 'ss', 'i', 'bi', 'ch', 'er', 've',
+             'rd', 'gio', 'va', 'ni', 'fra', 'nce', 'sco', 'el', 'ena', 'to', 'ma', 'so', 'chi', 'ara']
+WORDS = ['report', 'meeting', 'invoice', 'account', 'password', 'update', 'security', 'policy', 'team',
+         'quarter', 'review', 'deadline', 'approval', 'document', 'access', 'verify', 'urgent', 'please']
+TEXTS = {'utf-8': 'Perché è già così: città, più, però — “grazie” €',
+         'iso-8859-1': 'Perché è già così: città, più, però',
+         'windows-1252': 'Perché è già così: città, più, però — “grazie” €',
+         'us-ascii': 'Perche e gia cosi: citta, piu, pero'}
+TRANSFER_ENCODINGS = {'qp': 'quoted-printable', 'base64': 'base64', '8bit': '8bit', '7bit': '7bit'}
+
+
+#----------------------------------------
+# Synthetic corpus
+
+def generate_names(count, rng):
+    """Return count distinct capitalized pseudo-Italian names."""
+    names = set()
+    while len(names) < count:
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        names.add(name.capitalize())
+    return sorted(names)
+
+def generate_html(rng, first_names, last_names, paragraphs, text, index):
+    def person():
+        return f"{rng.choice(first_names)} {rng.choice(last_names)}"
+
+    def email():
+        return f"{rng.choice(first_names).lower()}.{rng.choice(last_names).lower()}@example.com"
+
+    rows = []
+    for paragraph in range(paragraphs):
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(12, 40)))
+        rows.append(
+            f'<tr><td class="content" style="padding: 8px; font-family: Arial">'
+            f'<p>{person()}, {sentence} {text}.</p>'
+            f'<p>Contact <a href="mailto:{email()}">{email()}</a> or '
+            f'<a href="https://intranet.example.com/{index}/{paragraph}?id={rng.randint(0, 10**6)}" '
+            f'class="btn  primary" onclick="track({paragraph})">open the {rng.choice(WORDS)}</a>.</p>'
+            f'<!-- <a href="https://old.example.com/{paragraph}">old</a> --></td></tr>')
+    return (
+        '<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Notice</title>'
+        '<style>td { color: #333; } .btn { font-weight: bold; }</style>'
+        f'<script>var session = "{rng.randint(0, 10**9)}";</script></head>'
+        f'<body onload="init()"><table width="600"><tr><td><img src="cid:logo{index}@corp" alt="logo"></td></tr>'
+        + ''.join(rows) +
+        f'</table><p>{person()}<br>{rng.choice(WORDS).title()} &amp; {rng.choice(WORDS)} &nbsp;&mdash; {email()}</p>'
+        '<script type="text/javascript">document.write("tracking");</script>'
+        '<img src="https://track.example.com/pixel.gif" width="1" height="1"></body></html>')
+
+def generate_corpus(directory, emails=200, names=(), attachment_ratio=0.3, attachment_kb=200,
+                    inline_ratio=0.3, encodings=('utf-8',), transfer_encodings=('qp',), paragraphs=8,
+                    plain_ratio=0.1, subdirectories=4, seed=0, logos=0):
+    """
+    Write `emails` synthetic .eml files into subdirectories of directory.
+
+    The same arguments and seed always produce the same files. Roughly
+    attachment_ratio of the messages carry a binary attachment of about
+    attachment_kb KB, inline_ratio an inline image referenced by cid, and
+    plain_ratio have no HTML part. With logos, the inline images are picked
+    among that many images instead of all being different.
+
+    :return: The total size of the corpus in bytes.
+    """
+    rng = random.Random(seed)
+    logo_rng = random.Random(seed + 1)
+    logo_images = [logo_rng.randbytes(logo_rng.randint(2, 20) * 1024) for _ in range(logos)]
+    half = max(1, len(names) // 2)
+    first_names, last_names = list(names[:half]) or ['Mario'], list(names[half:]) or ['Rossi']
+    total = 0
+    for index in range(emails):
+        charset = encodings[index % len(encodings)]
+        cte = TRANSFER_ENCODINGS[transfer_encodings[index % len(transfer_encodings)]]
+        if charset == 'us-ascii' and cte == '8bit':
+            cte = '7bit'
+        text = TEXTS.get(charset, TEXTS['utf-8'])
+
+        message = EmailMessage()
+        message['Subject'] = f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} #{index}"
+        message['From'] = f"{rng.choice(first_names)} <it-{index % 7}@example.com>"
+        message['To'] = f"{rng.choice(first_names).lower()}@corp.example.com"
+        message['Message-ID'] = f"<{index}.{seed}@bench.example.com>"
+        plain = f"{rng.choice(first_names)}, {' '.join(rng.choice(WORDS) for _ in range(60))} {text}"
+        if rng.random() < plain_ratio:
+            message.set_content(plain, charset=charset, cte=cte)
+        else:
+            html = generate_html(rng, first_names, last_names, paragraphs, text, index)
+            message.set_content(plain, charset=charset, cte=cte)
+            message.add_alternative(html, subtype='html', charset=charset, cte=cte)
+            if rng.random() < inline_ratio:
+                image = rng.choice(logo_images) if logo_images else rng.randbytes(rng.randint(2, 20) * 1024)
+                message.get_payload()[1].add_related(
+                    image, maintype='image', subtype='png',
+                    cid=f'<logo{index}@corp>')
+        if rng.random() < attachment_ratio:
+            size = max(1, int(rng.uniform(0.5, 1.5) * attachment_kb * 1024))
+            message.add_attachment(rng.randbytes(size), maintype='application', subtype='pdf',
+                                   filename=f'document{index}.pdf')
+
+        # The generator would pick random boundaries otherwise
+        for number, part in enumerate(message.walk()):
+            if part.is_multipart():
+                part.set_boundary(f'=====bench-{seed}-{index}-{number}=====')
+
+        subdirectory = os.path.join(directory, f'folder{index % subdirectories}')
+        os.makedirs(subdirectory, exist_ok=True)
+        data = message.as_bytes()
+        with open(os.path.join(subdirectory, f'mail{index:05d}.eml'), 'wb') as file:
+            file.write(data)
+        total += len(data)
+    return total
+
+
+#----------------------------------------
+# Stub Gophish server
+
+def clean_path(path):
+    """path as gorilla/mux, Gophish's router, cleans it: no '//', '.' or '..', the trailing slash kept."""
+    cleaned = posixpath.normpath('/' + re.sub('/+', '/', path).lstrip('/'))
+    if path.endswith('/') and cleaned != '/':
+        cleaned += '/'
+    return cleaned
+
+class StubGophishHandler(BaseHTTPRequestHandler):
+    """
+    Just enough of the Gophish REST API for CampaignManager: templates, groups, pages, smtp and campaigns.
+
+    Like Gophish, it answers a path that is not clean with a 301 to the
+    cleaned one, so a client that sends '//api/...' fails here as it would
+    against the real server.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, method):
+        state = self.server.state
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length)) if length else None
+        state.count(method)
+        if state.latency:
+            time.sleep(state.latency)
+        # self.path has a leading '//' collapsed already, the request line does not
+        target = self.raw_requestline.split()[1].decode('latin-1')
+        raw_path, _, query = target.partition('?')
+        if clean_path(raw_path) != raw_path:
+            self.send_response(301)
+            self.send_header('Location', clean_path(raw_path) + ('?' + query if query else ''))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        path = [part for part in raw_path.split('/') if part]
+
+        if len(path) < 2 or path[0] != 'api':
+            return self.reply(404, {'message': 'Not found', 'success': False})
+        kind = path[1]
+        if kind == 'campaigns':
+            return self.handle_campaigns(state, path[2:])
+        if kind not in state.resources:
+            return self.reply(404, {'message': 'Not found', 'success': False})
+        resources = state.resources[kind]
+        resource_id = int(path[2]) if len(path) > 2 else None
+        with state.lock:
+            if method == 'GET':
+                if resource_id is None:
+                    return self.reply(200, list(resources.values()))
+                if resource_id in resources:
+                    return self.reply(200, resources[resource_id])
+            elif method == 'POST':
+                state.next_id += 1
+                resource = dict(payload, id=state.next_id, modified_date=datetime.now(timezone.utc).isoformat())
+                resources[state.next_id] = resource
+                return self.reply(201, resource)
+            elif method == 'PUT' and resource_id in resources:
+                resources[resource_id] = dict(payload, id=resource_id)
+                return self.reply(200, resources[resource_id])
+            elif method == 'DELETE' and resources.pop(resource_id, None) is not None:
+                return self.reply(200, {'message': 'Deleted successfully!', 'success': True})
+        return self.reply(404, {'message': 'Not found', 'success': False})
+
+    def handle_campaigns(self, state, path):
+        if path == ['summary']:
+            return self.reply(200, {'total': len(state.campaigns), 'campaigns': [
+                {key: campaign[key] for key in ('id', 'name', 'status', 'launch_date', 'stats')}
+                for campaign in state.campaigns.values()]})
+        campaign = state.campaigns.get(int(path[0])) if path and path[0].isdigit() else None
+        if campaign is None:
+            return self.reply(404, {'message': 'Campaign not found', 'success': False})
+        if path[1:] == ['results']:
+            return self.reply(200, {key: campaign[key] for key in ('id', 'name', 'status', 'results', 'timeline')})
+        return self.reply(200, campaign)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+class StubState:
+    STATUSES = ['Email Sent', 'Email Opened', 'Clicked Link', 'Submitted Data', 'Error']
+
+    def __init__(self, latency=0.0, campaigns=0, results=0, seed=0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.requests = {}
+        self.resources = {'templates': {}, 'groups': {}, 'pages': {}, 'smtp': {}}
+        rng = random.Random(seed)
+        self.campaigns = {}
+        for campaign_id in range(1, campaigns + 1):
+            campaign_results = [{'id': f'{campaign_id}-{index}', 'email': f'user{index}@example.com',
+                                 'first_name': 'User', 'last_name': str(index), 'position': '',
+                                 'status': rng.choice(self.STATUSES), 'reported': rng.random() < 0.1}
+                                for index in range(results)]
+            timeline = [{'email': result['email'], 'time': f'2024-01-01T00:00:{index:06d}Z',
+                         'message': result['status'], 'details': ''}
+                        for index, result in enumerate(campaign_results)]
+            stats = {status: sum(result['status'] == status for result in campaign_results) for status in self.STATUSES}
+            self.campaigns[campaign_id] = {'id': campaign_id, 'name': f'Campaign {campaign_id}',
+                                           'status': 'In progress', 'launch_date': '2024-01-01T00:00:00Z',
+                                           'stats': stats, 'results': campaign_results, 'timeline': timeline}
+
+    def count(self, method):
+        with self.lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def take_requests(self):
+        with self.lock:
+            requests, self.requests = self.requests, {}
+        return requests
+
+@contextlib.contextmanager
+def stub_gophish_server(latency=0.0, campaigns=0, results=0, seed=0):
+    """Run a stub Gophish server on a free local port; yields (url, state)."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubGophishHandler)
+    server.daemon_threads = True
+    server.state = StubState(latency, campaigns, results, seed)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}", server.state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+#----------------------------------------
+# Measurements
+
+def max_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(resource.getrusage(who).ru_maxrss / scale, 1)
+
+def measure(func, items=1, size=0, memory=True):
+    """
+    Time func() and, if memory is True, run it again under tracemalloc for its peak allocation.
+
+    :param items: Number of items func processes, for the throughput.
+    :param size: Number of input bytes func processes, for the throughput.
+    :return: A dict of measurements and the value returned by the timed run.
+    """
+    gc.collect()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        value = func()
+    wall = time.perf_counter() - start_wall
+    result = {
+        'seconds': round(wall, 4),
+        'cpu_seconds': round(time.process_time() - start_cpu, 4),
+        'items': items,
+        'items_per_second': round(items / wall, 2) if wall else None,
+        'mb_per_second': round(size / wall / 1e6, 3) if wall and size else None,
+    }
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        result['peak_memory_mb'] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+        tracemalloc.stop()
+    return result, value
+
+def copy_corpus(source, destination):
+    shutil.rmtree(destination, ignore_errors=True)
+    shutil.copytree(source, destination, ignore=shutil.ignore_patterns('*.html', '.emlgo-manifest.json'))
+
+def write_mbox(files, mbox_path):
+    with open(mbox_path, 'wb') as mbox:
+        for file in files:
+            with open(file, 'rb') as eml:
+                data = eml.read().replace(b'\r\n', b'\n')
+            # mboxrd quoting
+            data = re.sub(rb'^(>*From )', rb'>\1', data, flags=re.M)
+            mbox.write(b'From benchmark@example.com Thu Jan  1 00:00:00 2026\n' + data.rstrip(b'\n') + b'\n\n')
+
+def benchmark_stages(corpus, names, args):
+    stages = {}
+    files = sorted(find_eml_files(corpus))
+    size = sum(os.path.getsize(file) for file in files)
+    memory = not args.no_memory
+
+    stages['eml_to_html'], htmls = measure(lambda: [eml_to_html(file) for file in files], len(files), size, memory)
+    html_size = sum(len(html.encode('utf-8', 'surrogateescape')) for html in htmls)
+
+    stages['anonymizer'], _ = measure(lambda: [anonymizer(html, names=names) for html in htmls],
+                                      len(htmls), html_size, memory)
+    stages['add_href_to_anchor_tags'], _ = measure(lambda: [add_href_to_anchor_tags(html, '{{.URL}}') for html in htmls],
+                                                   len(htmls), html_size, memory)
+    stages['remove_scripts'], _ = measure(lambda: [remove_scripts(html) for html in htmls],
+                                          len(htmls), html_size, memory)
+    for sanitizer in available_sanitizers():
+        stages[f'sanitize_{sanitizer}'], _ = measure(lambda: [sanitize_html(html, sanitizer) for html in htmls],
+                                                     len(htmls), html_size, memory)
+    transformer = GophishTransformer(names)
+    stages['gophish_transform'], templates = measure(lambda: [transformer.transform(html) for html in htmls],
+                                                     len(htmls), html_size, memory)
+    stages['dedupe'], _ = measure(
+        lambda: dedupe.cluster({index: dedupe.fingerprint(html) for index, html in enumerate(templates)}),
+        len(templates), html_size, memory)
+
+    # End to end on a copy of the corpus, converting everything every time
+    work = os.path.join(args.workdir, 'work')
+
+    def end_to_end(func):
+        copy_corpus(corpus, work)
+        return func()
+
+    # tracemalloc does not see worker processes, so only the serial runs get a peak
+    stages['emls_to_htmls'], _ = measure(lambda: end_to_end(lambda: emls_to_htmls(work, jobs=args.jobs, force=True)),
+                                         len(files), size, memory and args.jobs <= 1)
+    stages['gophishing_everything'], _ = measure(
+        lambda: end_to_end(lambda: gophishing_everything(work, names, jobs=args.jobs, force=True)),
+        len(files), size, memory and args.jobs <= 1)
+    assets = AssetStore(os.path.join(args.workdir, 'assets'))
+    stages['emls_to_htmls_assets'], _ = measure(
+        lambda: end_to_end(lambda: emls_to_htmls(work, jobs=args.jobs, force=True, assets=assets)),
+        len(files), size, memory and args.jobs <= 1)
+
+    # The same corpus as one mbox, converted without extracting it
+    mbox_path = os.path.join(args.workdir, 'corpus.mbox')
+    write_mbox(files, mbox_path)
+    mbox_output = os.path.join(args.workdir, 'mbox-html')
+    stages['mbox_to_htmls'], _ = measure(lambda: emls_to_htmls(mbox_path, jobs=args.jobs, output_dir=mbox_output),
+                                         len(files), os.path.getsize(mbox_path), memory and args.jobs <= 1)
+    return stages
+
+def benchmark_api(corpus, args):
+    # Imported here so that --no-api runs do not need the Gophish SDK
+    from goapi import CampaignManager, CampaignStore
+
+    stages = {}
+    templates = os.path.join(args.workdir, 'templates')
+    os.makedirs(templates, exist_ok=True)
+    rng = random.Random(args.seed)
+    html_files = sorted(file for file in (os.path.join(root, name) for root, _, names in os.walk(corpus)
+                                          for name in names) if file.endswith('.html'))
+    for index in range(args.templates):
+        # create_template names a template after file_name[9:-11]
+        shutil.copyfile(html_files[index % len(html_files)], os.path.join(templates, f'template_{index:05d}_phish.html'))
+    template_size = sum(os.path.getsize(os.path.join(templates, name)) for name in os.listdir(templates))
+
+    targets_csv = os.path.join(args.workdir, 'targets.csv')
+    with open(targets_csv, 'w', encoding='utf-8') as file:
+        file.write('First Name,Last Name,Email,Position\n')
+        for index in range(args.targets):
+            email = f'user{index}@example.com' if rng.random() > 0.01 else 'not-an-email'
+            file.write(f'User,{index},{email},Employee\n')
+
+    with stub_gophish_server(args.latency / 1000, args.campaigns, args.campaign_results, args.seed) as (url, state):
+        manager = CampaignManager(url, 'benchmark', workers=args.workers)
+
+        def stage(name, func, items, size=0):
+            stages[name], _ = measure(func, items, size, memory=False)
+            stages[name]['requests'] = state.take_requests()
+
+        stage('create_template', lambda: manager.create_template(templates, directory=True), args.templates, template_size)
+        stage('sync_templates_unchanged', lambda: manager.sync_templates(templates), args.templates, template_size)
+        for name in sorted(os.listdir(templates))[::10]:
+            with open(os.path.join(templates, name), 'a', encoding='utf-8') as file:
+                file.write('<!-- changed -->')
+        stage('sync_templates_changed', lambda: manager.sync_templates(templates), args.templates, template_size)
+        stage('delete_all_templates', manager.delete_all_templates, args.templates)
+        stage('create_group', lambda: manager.create_group('benchmark', targets_csv, group_size=args.group_size),
+              args.targets, os.path.getsize(targets_csv))
+        if args.campaigns:
+            store = CampaignStore(os.path.join(args.workdir, 'campaigns.sqlite'))
+            total = args.campaigns * args.campaign_results
+            stage('update_store_initial', lambda: manager.update_store(store), total)
+            stage('update_store_unchanged', lambda: manager.update_store(store), total)
+            stage('campaign_funnel', lambda: CampaignManager.campaign_funnel(store.summaries()), total)
+            store.close()
+    return stages
+
+def compare(previous, current):
+    """Print the change of every stage's wall time against a previous result file."""
+    print(f"{'stage':28} {'before':>10} {'after':>10} {'ratio':>8}")
+    for name, stage in current['stages'].items():
+        before = previous.get('stages', {}).get(name)
+        if not before:
+            continue
+        ratio = stage['seconds'] / before['seconds'] if before['seconds'] else float('inf')
+        print(f"{name:28} {before['seconds']:>9.3f}s {stage['seconds']:>9.3f}s {ratio:>7.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the emlgo conversion stages and Gophish API calls.')
+    parser.add_argument('--emails', type=int, default=200, help='Number of .eml files to generate')
+    parser.add_argument('--names', type=int, default=500, help='Size of the name dictionary used to anonymize')
+    parser.add_argument('--paragraphs', type=int, default=8, help='Paragraphs in each HTML body')
+    parser.add_argument('--attachment-ratio', type=float, default=0.3, help='Fraction of messages with an attachment')
+    parser.add_argument('--attachment-kb', type=int, default=200, help='Average attachment size in KB')
+    parser.add_argument('--inline-ratio', type=float, default=0.3, help='Fraction of HTML messages with an inline image')
+    parser.add_argument('--logos', type=int, default=0, help='Pick the inline images among this many images (0: all different)')
+    parser.add_argument('--plain-ratio', type=float, default=0.1, help='Fraction of messages with no HTML part')
+    parser.add_argument('--encodings', default='utf-8,iso-8859-1,windows-1252',
+                        help=f"Comma separated charsets used in turn ({', '.join(TEXTS)})")
+    parser.add_argument('--transfer-encodings', default='qp,base64,8bit',
+                        help=f"Comma separated transfer encodings used in turn ({', '.join(TRANSFER_ENCODINGS)})")
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the corpus generator')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Worker processes for the end-to-end stages')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc runs that measure peak memory')
+    parser.add_argument('--no-api', action='store_true', help='Skip the Gophish API benchmarks')
+    parser.add_argument('--templates', type=int, default=100, help='Templates uploaded to the stub server')
+    parser.add_argument('--targets', type=int, default=10000, help='Rows of the group CSV posted to the stub server')
+    parser.add_argument('--group-size', type=int, help='Split the group into groups of at most this size')
+    parser.add_argument('--campaigns', type=int, default=20, help='Campaigns served by the stub server')
+    parser.add_argument('--campaign-results', type=int, default=500, help='Results in each stub campaign')
+    parser.add_argument('--workers', '-w', type=int, default=8, help='Concurrent requests to the stub server')
+    parser.add_argument('--latency', type=float, default=5, help='Milliseconds the stub server waits before answering')
+    parser.add_argument('--corpus', help='Keep the generated corpus in this directory (reused if it exists)')
+    parser.add_argument('--output', '-o', help='Write the JSON results to this file instead of stdout')
+    parser.add_argument('--compare', help='Print the change against the JSON results of an earlier run')
+    args = parser.parse_args()
+
+    encodings = [encoding.strip() for encoding in args.encodings.split(',') if encoding.strip()]
+    transfer_encodings = [cte.strip() for cte in args.transfer_encodings.split(',') if cte.strip()]
+    for cte in transfer_encodings:
+        if cte not in TRANSFER_ENCODINGS:
+            parser.error(f"unknown transfer encoding '{cte}'")
+
+    rng = random.Random(args.seed)
+    names = generate_names(args.names, rng)
+    half = len(names) // 2
+    matcher = NameMatcher(names[:half], names[half:])
+
+    with tempfile.TemporaryDirectory(prefix='emlgo-bench-') as workdir:
+        args.workdir = workdir
+        corpus = args.corpus or os.path.join(workdir, 'corpus')
+        if not (args.corpus and os.path.isdir(corpus) and any(find_eml_files(corpus))):
+            generate_corpus(corpus, args.emails, names, args.attachment_ratio, args.attachment_kb,
+                            args.inline_ratio, encodings, transfer_encodings, args.paragraphs,
+                            args.plain_ratio, seed=args.seed, logos=args.logos)
+        files = list(find_eml_files(corpus))
+
+        start = time.perf_counter()
+        stages = benchmark_stages(corpus, matcher, args)
+        if not args.no_api:
+            # Upload the output of the last end-to-end run
+            stages.update(benchmark_api(os.path.join(workdir, 'work'), args))
+
+        results = {
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'config': {key: value for key, value in vars(args).items()
+                       if key not in ('workdir', 'output', 'compare')},
+            'corpus': {'files': len(files), 'bytes': sum(os.path.getsize(file) for file in files),
+                       'names': len(names)},
+            'stages': stages,
+            'total_seconds': round(time.perf_counter() - start, 3),
+            'max_rss_mb': max_rss_mb(),
+            'children_max_rss_mb': max_rss_mb(resource.RUSAGE_CHILDREN),
+        }
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            compare(json.load(file), results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Near-duplicate detection for the templates emlgo writes.
+
+Each template is reduced to a fingerprint: the SHA-256 of its normalized
+HTML, equal for exact duplicates, and a 64-bit SimHash of the word
+shingles of its text, a few bits apart for near-duplicates. Templates are
+clustered by the Hamming distance of their SimHashes through a banded
+index, so that only the pairs sharing a band are ever compared.
+"""
+import hashlib
+import re
+
+SIMHASH_BITS = 64
+DEFAULT_DISTANCE = 6
+SHINGLE_SIZE = 3
+
+# Dates, tracking IDs and counters: runs of digits and long hexadecimal tokens
+volatile_regex = re.compile(r'\b(?=[0-9a-f]*[0-9])[0-9a-f]{8,}\b|\d+')
+space_regex = re.compile(r'\s+')
+markup_regex = re.compile(r'<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>', re.S)
+token_regex = re.compile(r'[^\W\d_]+|\{\{\.\w+\}\}')
+
+# _byte_counts[i][b] spreads the bits of byte b, found at byte i of a hash,
+# into one counter field per hash bit, so that a single integer addition
+# counts the bits of 8 positions at once
+_FIELD_BITS = 32
+_byte_counts = [[sum(((value >> bit) & 1) << (_FIELD_BITS * (8 * index + bit)) for bit in range(8))
+                 for value in range(256)]
+                for index in range(SIMHASH_BITS // 8)]
+
+def normalize(html_content):
+    html_content = volatile_regex.sub('0', html_content.lower())
+    return space_regex.sub(' ', html_content).strip()
+
+def simhash(text):
+    """SimHash of the set of word shingles of text."""
+    tokens = token_regex.findall(text)
+    shingles = {' '.join(tokens[index:index + SHINGLE_SIZE])
+                for index in range(max(len(tokens) - SHINGLE_SIZE + 1, 1))}
+    counts = 0
+    for shingle in shingles:
+        digest = hashlib.blake2b(shingle.encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+        counts += sum(table[byte] for table, byte in zip(_byte_counts, digest))
+    mask = (1 << _FIELD_BITS) - 1
+    value = 0
+    for bit in range(SIMHASH_BITS):
+        if ((counts >> (_FIELD_BITS * bit)) & mask) * 2 > len(shingles):
+            value |= 1 << bit
+    return value
+
+def fingerprint(html_content):
+    """
+    Return (SHA-256 of the normalized HTML, SimHash of its text) of a template.
+
+    Markup is left out of the SimHash: templates of the same sender share
+    most of it, and it would hide the differences in the text.
+    """
+    html_content = normalize(html_content)
+    text = markup_regex.sub(' ', html_content)
+    return hashlib.sha256(html_content.encode('utf-8', 'surrogateescape')).hexdigest(), simhash(text)
+
+def distance(first, second):
+    return bin(first ^ second).count('1')
+
+def cluster(fingerprints, max_distance=DEFAULT_DISTANCE):
+    """
+    Group the keys of fingerprints ({key: (digest, simhash)}) into clusters.
+
+    Keys with the same digest, or whose SimHashes differ in at most
+    max_distance bits, end up in the same cluster, transitively. Returns
+    the clusters as sorted lists of keys, in the order of their first key.
+    """
+    parents = {key: key for key in fingerprints}
+
+    def find(key):
+        while parents[key] != key:
+            parents[key] = parents[parents[key]]
+            key = parents[key]
+        return key
+
+    def union(first, second):
+        first, second = find(first), find(second)
+        if first != second:
+            parents[max(first, second)] = min(first, second)
+
+    by_digest = {}
+    for key in sorted(fingerprints):
+        digest = fingerprints[key][0]
+        if digest in by_digest:
+            union(by_digest[digest], key)
+        else:
+            by_digest[digest] = key
+
+    # Two hashes at most max_distance bits apart are equal on at least one of
+    # max_distance + 1 bands, so only keys sharing a band need comparing
+    unique = sorted(by_digest.values())
+    bands = max_distance + 1
+    width = SIMHASH_BITS // bands
+    index = {}
+    for key in unique:
+        value = fingerprints[key][1]
+        for band in range(bands):
+            shift = band * width
+            band_width = width if band < bands - 1 else SIMHASH_BITS - shift
+            bucket = index.setdefault((band, (value >> shift) & ((1 << band_width) - 1)), [])
+            for other in bucket:
+                if find(other) != find(key) and distance(value, fingerprints[other][1]) <= max_distance:
+                    union(other, key)
+            bucket.append(key)
+
+    clusters = {}
+    for key in sorted(fingerprints):
+        clusters.setdefault(find(key), []).append(key)
+    return sorted(clusters.values())
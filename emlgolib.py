@@ -1,32 +1,119 @@
 import os
+import functools
+import hashlib
+import io
+import itertools
+import json
+import mmap
 from email import policy
 from email.parser import BytesParser
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+import metrics
 import re
+import threading
 
 #COSTANTI
 FirstName = '{{.FirstName}}'
 LastName = '{{.LastName}}'
 Email = '{{.Email}}'
+Tracker = '{{.Tracker}}'
+
+email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
+anchor_pattern = r'<a\s+(?:(?!-->).)*?>'
+href_pattern = r'href="([^"]*)"'
+
+CACHE_DIR = os.path.expanduser('~/.cache/emlgo')
+MANIFEST_NAME = '.emlgo-manifest.json'
+CLUSTERS_NAME = '.emlgo-clusters.json'
 
 def read_values_from_file(file_path):
     expanded_path = os.path.expanduser(file_path)
     values = []
     with open(expanded_path, 'r') as file:
         for line in file:
-            values.append(line.strip())
+            value = line.strip()
+            if value: # an empty name would match everywhere
+                values.append(value)
     return values
 
-def eml_to_html(eml_file):
+header_end_regex = re.compile(rb'\r?\n\r?\n|\r\r')
+
+def message_skeleton(data, start=0, end=None, keep=None):
+    """Yield the bytes of the MIME entity data[start:end] without the bodies of its non-text leaf parts,
+    unless keep(headers) is true; only headers are parsed, the rest is copied as it is."""
+    if end is None:
+        end = len(data)
+    if start >= end:
+        return
+    match = header_end_regex.search(data, start, end)
+    if data[start:start + 1] in (b'\r', b'\n') or not match:
+        yield data[start:end]
+        return
+    body_start = match.end()
+    headers = BytesParser(policy=policy.default).parsebytes(data[start:body_start], headersonly=True)
+    maintype = headers.get_content_maintype()
+
+    if maintype == 'multipart':
+        boundary = headers.get_boundary()
+        try:
+            boundary = boundary.encode('ascii', 'surrogateescape') if boundary else None
+        except UnicodeEncodeError:
+            boundary = None
+        if not boundary:
+            yield data[start:end]
+            return
+        boundary_regex = re.compile(rb'^--' + re.escape(boundary) + rb'(?P<close>--)?[ \t]*(?:\r\n|\r|\n|\Z)', re.M)
+        position = start
+        part_start = None
+        for boundary_match in boundary_regex.finditer(data, body_start, end):
+            if part_start is None:
+                # headers and preamble
+                yield data[position:boundary_match.start()]
+            else:
+                yield from message_skeleton(data, part_start, boundary_match.start(), keep)
+            if boundary_match.group('close'):
+                # close delimiter and epilogue
+                yield data[boundary_match.start():end]
+                return
+            yield data[boundary_match.start():boundary_match.end()]
+            part_start = boundary_match.end()
+        if part_start is None:
+            yield data[start:end]
+        else:
+            yield from message_skeleton(data, part_start, end, keep)
+    elif headers.get_content_type() == 'message/rfc822':
+        yield data[start:body_start]
+        yield from message_skeleton(data, body_start, end, keep)
+    elif maintype == 'text' or (keep and keep(headers)):
+        yield data[start:end]
+    else:
+        yield data[start:body_start]
+
+def read_skeleton(eml_file, keep=None):
+    """Return the skeleton of an .eml file, see message_skeleton."""
     with open(eml_file, 'rb') as file:
-        msg = BytesParser(policy=policy.default).parse(file)
-    
+        size = os.fstat(file.fileno()).st_size
+        metrics.add_bytes(read=size)
+        if size == 0:
+            return b''
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return b''.join(message_skeleton(data, keep=keep))
+
+def parse_skeleton(skeleton):
+    # parse() rather than parsebytes(): it reads with universal newlines
+    return BytesParser(policy=policy.default).parse(io.BytesIO(skeleton))
+
+def read_message(eml_file, keep=None):
+    """Parse an .eml file, leaving out the payload of its attachments."""
+    return parse_skeleton(read_skeleton(eml_file, keep))
+
+def message_to_html(msg):
     html_content = None
     for part in msg.walk():
         if part.get_content_type() == "text/html":
             html_content = part.get_payload(decode=True)
             break
-    
+
     if html_content:
         return html_content.decode('utf-8', errors='replace')
     else:
@@ -36,6 +123,41 @@ def eml_to_html(eml_file):
         else:
             return "<html><body>No content found</body></html>"
 
+def eml_to_html(eml_file, assets=None, output_dir=None):
+    """Return the HTML of an .eml file; with an AssetStore its cid: images point to the stored copies."""
+    with metrics.stage('mime_parse'):
+        msg = read_message(eml_file, is_inline_image if assets is not None else None)
+        html_content = message_to_html(msg)
+    if assets is not None:
+        html_content = assets.resolve(msg, html_content, output_dir)
+    return html_content
+
+def read_html(html_file, encoding=None):
+    with metrics.stage('read'):
+        with open(html_file, 'r', encoding=encoding) as file:
+            html_content = file.read()
+        metrics.add_bytes(read=os.path.getsize(html_file))
+    return html_content
+
+def write_html(output_file, html_content, encoding=None):
+    with metrics.stage('write'):
+        with open(output_file, 'w', encoding=encoding) as output:
+            output.write(html_content)
+            metrics.add_bytes(written=output.tell())
+
+def write_atomic(path, data):
+    # Written under a name unique to this process and thread, then renamed: readers never see half a file
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    binary = isinstance(data, bytes)
+    try:
+        with open(temp_path, 'wb' if binary else 'w', encoding=None if binary else 'utf-8') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
 """def add_href_to_anchor_tags(html_content, new_href): # no support conditional
     soup = BeautifulSoup(html_content, 'html.parser')
     anchor_tags = soup.find_all('a')
@@ -43,82 +165,982 @@ def eml_to_html(eml_file):
         tag['href'] = new_href
     return str(soup)"""
 
-def add_href_to_anchor_tags(html_content, new_href):
-    # Define a regular expression pattern to match anchor tags
-    anchor_pattern = r'<a\s+(?:(?!-->).)*?>'
-    # Define a regular expression pattern to match the href attribute within anchor tags
-    href_pattern = r'href="([^"]*)"'
+def is_inline_image(headers):
+    return headers.get_content_maintype() == 'image' and 'Content-ID' in headers
+
+cid_regex = re.compile(r'\bcid:([^\s"\'()<>;]+)', re.I)
+
+class AssetStore:
+    """Inline images stored once under their SHA-256, and the cid: references rewritten to point to them."""
 
+    def __init__(self, directory, base_url=None):
+        self.directory = os.path.abspath(directory)
+        self.base_url = base_url
+
+    def put(self, data, content_type):
+        """Store data unless already there and return its name in the store."""
+        digest = hashlib.sha256(data).hexdigest()
+        name = f"{digest[:2]}/{digest}{self.extension(content_type)}"
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, data)
+            metrics.add_bytes(written=len(data))
+        return name
+
+    @staticmethod
+    def extension(content_type):
+        import mimetypes
+        return mimetypes.guess_extension(content_type) or '.bin'
+
+    def url(self, name, output_dir):
+        if self.base_url is not None:
+            return self.base_url.rstrip('/') + '/' + name
+        return os.path.relpath(os.path.join(self.directory, name), output_dir).replace(os.sep, '/')
+
+    def resolve(self, msg, html_content, output_dir):
+        """Store the inline images html_content refers to and point the cid: URLs to them."""
+        from urllib.parse import unquote
+        with metrics.stage('assets'):
+            wanted = {unquote(cid).strip('<>') for cid in cid_regex.findall(html_content)}
+            if not wanted:
+                return html_content
+            urls = {}
+            for part in msg.walk():
+                cid = str(part.get('Content-ID', '')).strip().strip('<>')
+                if cid in wanted and cid not in urls and is_inline_image(part):
+                    data = part.get_payload(decode=True)
+                    if data:
+                        urls[cid] = self.url(self.put(data, part.get_content_type()), output_dir)
+
+            def replace(match):
+                return urls.get(unquote(match.group(1)).strip('<>'), match.group())
+
+            return cid_regex.sub(replace, html_content)
+
+    def report(self, html_files):
+        """Return the references to stored images in html_files, the distinct images, and the bytes
+        the references would take without the store and the bytes stored."""
+        name_regex = re.compile(r'([0-9a-f]{2})/(\1[0-9a-f]{62}\.\w+)')
+        sizes = {}
+        references = 0
+        referenced_bytes = 0
+        for html_file in html_files:
+            with open(html_file, 'r', encoding='utf-8', errors='replace') as file:
+                html_content = file.read()
+            for match in name_regex.finditer(html_content):
+                name = match.group()
+                if name not in sizes:
+                    path = os.path.join(self.directory, name)
+                    sizes[name] = os.path.getsize(path) if os.path.exists(path) else None
+                if sizes[name] is not None:
+                    references += 1
+                    referenced_bytes += sizes[name]
+        stored = [size for size in sizes.values() if size is not None]
+        return references, len(stored), referenced_bytes, sum(stored)
+
+    def print_report(self, html_files):
+        references, images, referenced_bytes, stored_bytes = self.report(html_files)
+        if references:
+            print(f"{references} inline images, {images} stored once in {self.directory}: "
+                  f"{(referenced_bytes - stored_bytes) / 1e6:.1f} MB of duplicates not stored")
+
+def add_href_to_anchor_tags(html_content, new_href):
     def replace_href(match):
         href_attr = match.group(1)
         # Replace href attribute with the new href
         return f'href="{new_href}"'
 
     # Use re.sub to find anchor tags and modify their href attributes
-    modified_html = re.sub(anchor_pattern, lambda match: re.sub(href_pattern, replace_href, match.group(0)), html_content)
+    with metrics.stage('href_rewrite'):
+        modified_html = re.sub(anchor_pattern, lambda match: re.sub(href_pattern, replace_href, match.group(0)), html_content)
     return modified_html
 
 def add_href_to_file(file_path, new_href):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        html_content = file.read()
+    html_content = read_html(file_path, encoding='utf-8')
     modified_html = add_href_to_anchor_tags(html_content, new_href)
-    modified_html = modified_html.replace('</html>', '{{.Tracker}}\n</html>')
-    with open(file_path, 'w', encoding='utf-8') as file:
-        file.write(modified_html)
-
-def anonymizer(html_content,nomi,cognomi): # Still have to think (maybe list of all name possible?) Performance problem???
-    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-    modified_html = re.sub(email_pattern, Email, html_content)
-    for nome in nomi:
-        if nome in modified_html:
-            modified_html = modified_html.replace(nome,FirstName)
-    for cognome in cognomi:
-        if cognome in modified_html:
-            modified_html = modified_html.replace(cognome,LastName)
-    
-    return modified_html
+    modified_html = modified_html.replace('</html>', Tracker + '\n</html>')
+    write_html(file_path, modified_html, encoding='utf-8')
+
+class NameMatcher:
+    """Match first and last names with one regex shaped like a trie of the names, longest name first.
+    The pattern is cached in cache_dir; a name in both lists counts as a first name."""
+
+    def __init__(self, nomi=(), cognomi=(), whole_words=False, ignore_case=False, cache_dir=None):
+        self.ignore_case = ignore_case
+        self.placeholders = {}
+        for cognome in cognomi:
+            self.placeholders[self._key(cognome)] = LastName
+        for nome in nomi:
+            self.placeholders[self._key(nome)] = FirstName
+        self.pattern = None
+        self._regex = None
+        if not self.placeholders:
+            return
+
+        digest = hashlib.sha256(repr((sorted(self.placeholders.items()), whole_words, ignore_case)).encode()).hexdigest()
+        cache_file = os.path.join(cache_dir, f"names-{digest}.re") if cache_dir else None
+        if cache_file and os.path.exists(cache_file):
+            with open(cache_file, 'r', encoding='utf-8') as file:
+                self.pattern = file.read()
+            return
+
+        trie = {}
+        for name in self.placeholders:
+            node = trie
+            for char in name:
+                node = node.setdefault(char, {})
+            node[''] = True
+        pattern = self._trie_pattern(trie)
+        if whole_words:
+            pattern = rf'\b(?:{pattern})\b'
+        self.pattern = f'(?i:{pattern})' if ignore_case else f'(?:{pattern})'
+
+        if cache_file:
+            os.makedirs(cache_dir, exist_ok=True)
+            write_atomic(cache_file, self.pattern)
+
+    def _key(self, name):
+        return name.lower() if self.ignore_case else name
+
+    @classmethod
+    def _trie_pattern(cls, node):
+        # '' marks the end of a name; the optional group is greedy, so the
+        # longest name wins and shorter ones are tried on backtracking
+        branches = [re.escape(char) + cls._trie_pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{pattern})?' if '' in node else pattern
 
-def gophishing_everything(directory_path):
+    def __bool__(self):
+        return self.pattern is not None
+
+    def __getstate__(self):
+        # Let each worker process compile the regex itself, and only if needed
+        return {**self.__dict__, '_regex': None}
+
+    @property
+    def regex(self):
+        if self._regex is None:
+            self._regex = re.compile(self.pattern)
+        return self._regex
+
+    def placeholder(self, name):
+        return self.placeholders[self._key(name)]
+
+    def sub(self, text):
+        if not self:
+            return text
+        return self.regex.sub(lambda match: self.placeholder(match.group()), text)
+
+def anonymizer(html_content, nomi=(), cognomi=(), names=None):
+    with metrics.stage('anonymize'):
+        modified_html = re.sub(email_pattern, Email, html_content)
+        if names is None:
+            names = NameMatcher(nomi, cognomi)
+        return names.sub(modified_html)
+
+def find_eml_files(directory_path):
     for root, dirs, files in os.walk(directory_path):
         for file in files:
             if file.endswith('.eml'):
-                eml_file = os.path.join(root, file)
-                html_content = eml_to_html(eml_file)
-                modified_html = anonymizer(html_content,nomi,cognomi)
-                modified_html_with_href = add_href_to_anchor_tags(modified_html, '{{.URL}}')
-                modified_html_with_href = modified_html_with_href.replace('</html>', '{{.Tracker}}\n</html>')
-                modified_html_no_script = remove_scripts(modified_html_with_href)
-
-                output_file = os.path.splitext(eml_file)[0] + ".html"
-                with open(output_file, 'w') as output:
-                    output.write(modified_html_no_script)
-
-def remove_scripts_from_directory(directory_path):
+                yield os.path.join(root, file)
+
+def run_on_files(func, files, jobs=1, initializer=None, initargs=(), executor=None):
+    """Apply func to every file, serially or on `jobs` processes or a running executor,
+    yielding (file, result, error) as work completes."""
+    current = metrics.current()
+    if current is None:
+        yield from _run_on_files(func, files, jobs, initializer, initargs, executor)
+        return
+    measured = functools.partial(metrics.measure_file, func, profile=current.profile)
+    for file, result, error in _run_on_files(measured, files, jobs, initializer, initargs, executor):
+        if not error:
+            result, file_metrics = result
+            current.merge(file_metrics)
+        yield file, result, error
+
+def _run_on_files(func, files, jobs, initializer, initargs, executor=None):
+    if executor is not None:
+        yield from _run_on_pool(func, files, jobs, executor)
+        return
+    if jobs <= 1:
+        if initializer:
+            initializer(*initargs)
+        for file in files:
+            try:
+                yield file, func(file), None
+            except Exception as e:
+                yield file, None, e
+        return
+
+    # Imported here: loading multiprocessing costs more than a small serial run
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as executor:
+        yield from _run_on_pool(func, files, jobs, executor)
+
+def _run_on_pool(func, files, jobs, executor):
+    from concurrent.futures import wait, FIRST_COMPLETED
+    files = iter(files)
+    pending = {}
+    for file in files:
+        pending[executor.submit(func, file)] = file
+        if len(pending) >= jobs * 2:
+            break
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            file = pending.pop(future)
+            try:
+                yield file, future.result(), None
+            except Exception as e:
+                yield file, None, e
+            # Refill the pool with the next file, if any
+            for next_file in files:
+                pending[executor.submit(func, next_file)] = next_file
+                break
+
+def eml_file_to_html_file(eml_file, assets=None):
+    output_file = os.path.splitext(eml_file)[0] + ".html"
+    html_content = eml_to_html(eml_file, assets, os.path.dirname(output_file))
+    write_html(output_file, html_content)
+    return output_file
+
+def emls_to_htmls(directory_path, jobs=1, force=False, output_dir=None, assets=None):
+    """Convert every .eml file of a directory, or every message of a mailbox, to HTML."""
+    if mailbox_kind(directory_path):
+        output_dir = output_dir or default_output_dir(directory_path)
+        result = convert_mailbox(directory_path, functools.partial(convert_message, assets=assets), output_dir, jobs)
+    else:
+        output_dir = directory_path
+        settings = 'eml_to_html' if assets is None else ('eml_to_html', assets.directory, assets.base_url)
+        result = convert_directory(directory_path, functools.partial(eml_file_to_html_file, assets=assets),
+                                   settings, jobs, force=force)
+    if assets is not None:
+        assets.print_report(find_html_files(output_dir))
+    return result
+
+class GophishTransformer:
+    """Turn the HTML of an email into a Gophish template: emails, links and </html> in one regex pass,
+    names in between with the NameMatcher's regex, then sanitize."""
+
+    def __init__(self, names=None, new_href='{{.URL}}', sanitizer='stream', strip_handlers=True):
+        self.names = names if names is not None else NameMatcher()
+        self.new_href = new_href
+        self.sanitizer = sanitizer
+        self.strip_handlers = strip_handlers
+        self.email_regex = re.compile(email_pattern)
+        self.regex = re.compile(f'(?P<anchor>{anchor_pattern})|(?P<email>{email_pattern})|(?P<tracker></html>)')
+        self.href_regex = re.compile(href_pattern)
+        self.replacements = {'email': Email, 'tracker': Tracker + '\n</html>'}
+
+    def _replace(self, match):
+        if match.lastgroup != 'anchor':
+            return self.replacements[match.lastgroup]
+        anchor = self.names.sub(self.email_regex.sub(Email, match.group()))
+        anchor = self.href_regex.sub(f'href="{self.new_href}"', anchor)
+        return anchor.replace('</html>', self.replacements['tracker'])
+
+    def _rewrite(self, html_content):
+        if not self.names:
+            return self.regex.sub(self._replace, html_content)
+        parts = []
+        position = 0
+        for match in self.regex.finditer(html_content):
+            parts.append(self.names.sub(html_content[position:match.start()]))
+            parts.append(self._replace(match))
+            position = match.end()
+        parts.append(self.names.sub(html_content[position:]))
+        return ''.join(parts)
+
+    def transform(self, html_content):
+        with metrics.stage('rewrite'):
+            html_content = self._rewrite(html_content)
+        return sanitize_html(html_content, self.sanitizer, self.strip_handlers)
+
+def gophish_eml_file(eml_file, transformer, assets=None):
+    output_file = os.path.splitext(eml_file)[0] + ".html"
+    html_content = eml_to_html(eml_file, assets, os.path.dirname(output_file))
+    modified_html = transformer.transform(html_content)
+
+    write_html(output_file, modified_html)
+    return output_file
+
+# The transformer is built once per worker process, not pickled per file
+_worker_transformer = None
+_worker_assets = None
+
+def _init_gophish_worker(names, sanitizer='stream', strip_handlers=True, assets=None):
+    global _worker_transformer, _worker_assets
+    _worker_transformer = GophishTransformer(names, sanitizer=sanitizer, strip_handlers=strip_handlers)
+    _worker_assets = assets
+
+def _gophish_worker(eml_file):
+    return gophish_eml_file(eml_file, _worker_transformer, _worker_assets)
+
+def _gophish_message_worker(message, output_dir):
+    return convert_message(message, output_dir, _worker_transformer.transform, _worker_assets)
+
+def gophish_settings(names=None, sanitizer='stream', strip_handlers=True, max_distance=None, assets=None):
+    """What the templates written by gophishing_everything depend on, for the manifest."""
+    return ('gophish', names.pattern if names else None, '{{.URL}}', Tracker, sanitizer, strip_handlers,
+            max_distance, assets and (assets.directory, assets.base_url))
+
+def gophishing_everything(directory_path, names=None, jobs=1, force=False, sanitizer='stream', strip_handlers=True,
+                          output_dir=None, max_distance=None, assets=None):
+    """Turn every .eml file of a directory, or every message of a mailbox, into a template;
+    with max_distance, near-duplicate templates are kept only once."""
+    initargs = (names, sanitizer, strip_handlers, assets)
+    if mailbox_kind(directory_path):
+        output_dir = output_dir or default_output_dir(directory_path)
+        result = convert_mailbox(directory_path, _gophish_message_worker, output_dir, jobs,
+                                 initializer=_init_gophish_worker, initargs=initargs, max_distance=max_distance)
+    else:
+        output_dir = directory_path
+        settings = gophish_settings(names, sanitizer, strip_handlers, max_distance, assets)
+        result = convert_directory(directory_path, _gophish_worker, settings, jobs, force=force,
+                                   initializer=_init_gophish_worker, initargs=initargs, max_distance=max_distance)
+    if assets is not None:
+        assets.print_report(find_html_files(output_dir))
+    return result
+
+class BuildManifest:
+    """Size, mtime, SHA-256 and settings of the .eml files already converted in a directory,
+    so that only the files whose content or settings changed are converted again."""
+
+    def __init__(self, directory_path, settings):
+        self.directory_path = directory_path
+        self.path = os.path.join(directory_path, MANIFEST_NAME)
+        self.settings = hashlib.sha256(repr(settings).encode()).hexdigest()
+        self.entries = {}
+        self.pending = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    self.entries = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable manifest {self.path}: {e}")
+
+    def _key(self, eml_file):
+        return os.path.relpath(eml_file, self.directory_path)
+
+    def is_stale(self, eml_file):
+        key = self._key(eml_file)
+        stat = os.stat(eml_file)
+        entry = self.entries.get(key)
+        self.pending[key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        if (not entry or entry['settings'] != self.settings
+                or not os.path.exists(os.path.join(self.directory_path, entry['output']))):
+            return True
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return False
+        digest = file_digest(eml_file)
+        self.pending[key]['sha256'] = digest
+        if entry['sha256'] != digest:
+            return True
+        entry.update(self.pending.pop(key))
+        return False
+
+    def record(self, eml_file, output_file):
+        key = self._key(eml_file)
+        entry = self.pending.pop(key, None)
+        if entry is None:
+            stat = os.stat(eml_file)
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        if 'sha256' not in entry:
+            entry['sha256'] = file_digest(eml_file)
+        entry['settings'] = self.settings
+        entry['output'] = self._key(output_file)
+        self.entries[key] = entry
+
+    def remove_orphans(self, eml_files):
+        """Delete the outputs of source files that are gone."""
+        keys = {self._key(eml_file) for eml_file in eml_files}
+        for key in list(self.entries):
+            if key not in keys:
+                entry = self.entries.pop(key)
+                output_file = os.path.join(self.directory_path, entry['output'])
+                # the output of a duplicate is its representative's
+                if 'duplicate_of' not in entry and os.path.exists(output_file):
+                    os.remove(output_file)
+
+    def deduplicate(self, max_distance):
+        """Keep one output per cluster of near-duplicates; returns the cluster report and the sources
+        to convert again because their cluster has no output left."""
+        import dedupe
+        fingerprints = {}
+        for key, entry in self.entries.items():
+            if 'fingerprint' not in entry:
+                try:
+                    html_content = read_html(os.path.join(self.directory_path, entry['output']))
+                    entry['fingerprint'] = list(dedupe.fingerprint(html_content))
+                except OSError:
+                    continue
+            fingerprints[key] = tuple(entry['fingerprint'])
+
+        representatives = []
+        unrepresented = []
+        for members in dedupe.cluster(fingerprints, max_distance):
+            owners = [key for key in members if 'duplicate_of' not in self.entries[key]]
+            if not owners:
+                unrepresented.append(os.path.join(self.directory_path, members[0]))
+                continue
+            representative = owners[0]
+            representatives.append((representative, members))
+            for key in members:
+                entry = self.entries[key]
+                if key == representative or entry.get('duplicate_of') == representative:
+                    continue
+                output_file = os.path.join(self.directory_path, entry['output'])
+                if 'duplicate_of' not in entry and os.path.exists(output_file):
+                    os.remove(output_file)
+                entry['duplicate_of'] = representative
+                entry['output'] = self.entries[representative]['output']
+        return cluster_report(representatives, fingerprints, lambda key: self.entries[key]['output']), unrepresented
+
+    def save(self):
+        write_atomic(self.path, json.dumps(self.entries))
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def convert_directory(directory_path, func, settings, jobs=1, force=False, initializer=None, initargs=(),
+                      max_distance=None):
+    """Convert with func the .eml files of a directory that changed since the last run;
+    returns the number of converted files and of errors."""
+    with metrics.stage('manifest'):
+        manifest = BuildManifest(directory_path, settings)
+        eml_files = list(find_eml_files(directory_path))
+        stale_files = []
+        unreadable = []
+        for eml_file in eml_files:
+            try:
+                if manifest.is_stale(eml_file) or force:
+                    stale_files.append(eml_file)
+            except OSError as e:
+                # A dangling link or a file deleted during the walk: report it like a failed conversion
+                unreadable.append((eml_file, None, e))
+        manifest.remove_orphans(eml_files)
+
+    def record(results):
+        for file, output_file, error in results:
+            if not error:
+                manifest.record(file, output_file)
+            yield file, output_file, error
+
+    try:
+        converted, errors = _report(itertools.chain(
+            unreadable, record(run_on_files(func, stale_files, jobs, initializer, initargs))))
+        if max_distance is not None:
+            with metrics.stage('dedupe'):
+                report, unrepresented = manifest.deduplicate(max_distance)
+            if unrepresented:
+                # Clusters whose representative changed or is gone: convert one member again
+                _report(record(run_on_files(func, unrepresented, jobs, initializer, initargs)))
+                with metrics.stage('dedupe'):
+                    report, _ = manifest.deduplicate(max_distance)
+            save_cluster_report(os.path.join(directory_path, CLUSTERS_NAME), report)
+        return converted, errors
+    finally:
+        with metrics.stage('manifest'):
+            manifest.save()
+
+def cluster_report(representatives, fingerprints, output_of):
+    """Describe the clusters of more than one member, given as (representative, members) pairs."""
+    import dedupe
+    report = []
+    for representative, members in representatives:
+        if len(members) < 2:
+            continue
+        digest, simhash = fingerprints[representative]
+        report.append({
+            'representative': representative,
+            'output': output_of(representative),
+            'duplicates': [{'source': key,
+                            'exact': fingerprints[key][0] == digest,
+                            'distance': dedupe.distance(simhash, fingerprints[key][1])}
+                           for key in members if key != representative],
+        })
+    return report
+
+def save_cluster_report(path, report):
+    duplicates = sum(len(cluster['duplicates']) for cluster in report)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=1)
+    print(f"{duplicates} near-duplicates in {len(report)} clusters kept as one template each, see {path}")
+
+def _report(results):
+    converted = 0
+    errors = 0
+    for file, output_file, error in results:
+        if error:
+            errors += 1
+            print(f"Error converting {file}: {error}")
+        else:
+            converted += 1
+    if errors:
+        print(f"Converted {converted} files, {errors} errors.")
+    return converted, errors
+
+class MailboxMessage:
+    """Where a message is stored in a mailbox, to read it without extracting it; tar members carry their bytes."""
+
+    def __init__(self, mailbox, kind, key, start=0, end=None, data=None):
+        self.mailbox = mailbox
+        self.kind = kind
+        self.key = key
+        self.start = start
+        self.end = end
+        self.data = data
+
+    def __str__(self):
+        return f"{self.mailbox}:{self.key}"
+
+    def read_skeleton(self, keep=None):
+        if self.kind == 'maildir':
+            return read_skeleton(self.key, keep)
+        if self.kind == 'mbox':
+            data = _map_file(self.mailbox, *_file_version(self.mailbox))
+            metrics.add_bytes(read=self.end - self.start)
+            # mboxrd quoting of body lines starting with "From "
+            return mbox_quote_regex.sub(rb'\1', b''.join(message_skeleton(data, self.start, self.end, keep)))
+        if self.kind == 'zip':
+            data = _open_zip(self.mailbox, *_file_version(self.mailbox)).read(self.key)
+        else:
+            data = self.data
+        metrics.add_bytes(read=len(data))
+        return b''.join(message_skeleton(data, keep=keep))
+
+mbox_quote_regex = re.compile(rb'^>(>*From )', re.M)
+
+def _file_version(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+# Kept open per process, keyed by size and mtime so that a changed mailbox is opened again
+@functools.lru_cache(maxsize=8)
+def _map_file(path, size, mtime):
+    with open(path, 'rb') as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+@functools.lru_cache(maxsize=8)
+def _open_zip(path, size, mtime):
+    import zipfile
+    return zipfile.ZipFile(path)
+
+def mailbox_kind(path):
+    """Return 'mbox', 'maildir', 'zip' or 'tar', or None for anything else."""
+    if os.path.isdir(path):
+        if all(os.path.isdir(os.path.join(path, sub)) for sub in ('cur', 'new')):
+            return 'maildir'
+        return None
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as file:
+        if file.read(5) == b'From ':
+            return 'mbox'
+    import zipfile
+    if zipfile.is_zipfile(path):
+        return 'zip'
+    import tarfile
+    if tarfile.is_tarfile(path):
+        return 'tar'
+    return None
+
+def iter_mbox(path):
+    """Yield the messages of an mbox file, found by scanning it for "From " lines."""
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            size = len(data)
+            start = 0
+            while start < size:
+                next_start = data.find(b'\nFrom ', start)
+                next_start = size if next_start < 0 else next_start + 1
+                # skip the "From " line, and leave out the line break before the next one
+                body_start = data.find(b'\n', start, next_start) + 1 or next_start
+                end = next_start
+                if end < size:
+                    end -= 2 if data[end - 2:end] == b'\r\n' else 1
+                yield MailboxMessage(path, 'mbox', start, body_start, max(end, body_start))
+                start = next_start
+
+def iter_maildir(path):
+    """Yield the messages of a Maildir and of its Maildir++ sub-folders."""
+    folders = [path] + sorted(os.path.join(path, name) for name in os.listdir(path)
+                              if name.startswith('.') and os.path.isdir(os.path.join(path, name, 'cur')))
+    for folder in folders:
+        for sub in ('new', 'cur'):
+            sub_path = os.path.join(folder, sub)
+            if not os.path.isdir(sub_path):
+                continue
+            for name in sorted(os.listdir(sub_path)):
+                file_path = os.path.join(sub_path, name)
+                if not name.startswith('.') and os.path.isfile(file_path):
+                    yield MailboxMessage(path, 'maildir', file_path)
+
+def iter_zip(path):
+    """Yield the .eml members of a zip archive."""
+    import zipfile
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if not info.is_dir() and info.filename.lower().endswith('.eml'):
+                yield MailboxMessage(path, 'zip', info.filename)
+
+def iter_tar(path):
+    """Yield the .eml members of a tar archive, compressed or not, reading it once in order."""
+    import tarfile
+    with tarfile.open(path, 'r|*') as archive:
+        for member in archive:
+            if member.isfile() and member.name.lower().endswith('.eml'):
+                yield MailboxMessage(path, 'tar', member.name, data=archive.extractfile(member).read())
+
+def iter_mailbox(path):
+    """Yield every message of an mbox, a Maildir or a zip or tar archive."""
+    iterators = {'mbox': iter_mbox, 'maildir': iter_maildir, 'zip': iter_zip, 'tar': iter_tar}
+    return iterators[mailbox_kind(path)](path)
+
+message_id_unsafe_regex = re.compile(r'[^A-Za-z0-9._@+-]')
+
+def message_file_name(msg, skeleton):
+    """Name the output of a message after its Message-ID, cleaned up and hashed if unsafe, or after its hash."""
+    # The raw value: the default policy cuts malformed IDs short
+    message_id = next((str(value) for key, value in msg.raw_items() if key.lower() == 'message-id'), '')
+    message_id = ' '.join(message_id.split()).strip('<>').strip()
+    if not message_id:
+        return hashlib.sha256(skeleton).hexdigest()[:32]
+    name = message_id_unsafe_regex.sub('_', message_id)
+    if name != message_id or len(name) > 100 or name.startswith('.'):
+        name = f"{name[:80]}-{hashlib.sha256(message_id.encode('utf-8', 'surrogateescape')).hexdigest()[:12]}"
+    return name
+
+def convert_message(message, output_dir, transform=None, assets=None):
+    skeleton = message.read_skeleton(is_inline_image if assets is not None else None)
+    with metrics.stage('mime_parse'):
+        msg = parse_skeleton(skeleton)
+        html_content = message_to_html(msg)
+    if assets is not None:
+        html_content = assets.resolve(msg, html_content, output_dir)
+    if transform:
+        html_content = transform(html_content)
+    output_file = os.path.join(output_dir, message_file_name(msg, skeleton) + ".html")
+    write_html(output_file, html_content)
+    return output_file
+
+def default_output_dir(mailbox_path):
+    return os.path.splitext(os.path.normpath(mailbox_path))[0] + '-html'
+
+def convert_mailbox(mailbox_path, func, output_dir=None, jobs=1, initializer=None, initargs=(), max_distance=None):
+    """Convert every message of a mailbox as it is read, into output_dir (next to the mailbox by default);
+    returns the number of converted messages and of errors."""
+    output_dir = output_dir or default_output_dir(mailbox_path)
+    os.makedirs(output_dir, exist_ok=True)
+    output_files = set()
+
+    def collect(results):
+        for message, output_file, error in results:
+            if not error:
+                output_files.add(output_file)
+            yield message, output_file, error
+
+    converted, errors = _report(collect(run_on_files(functools.partial(func, output_dir=output_dir),
+                                                     iter_mailbox(mailbox_path), jobs, initializer, initargs)))
+    if max_distance is not None:
+        import dedupe
+        with metrics.stage('dedupe'):
+            fingerprints = {os.path.basename(output_file): dedupe.fingerprint(read_html(output_file))
+                            for output_file in output_files}
+            representatives = [(members[0], members) for members in dedupe.cluster(fingerprints, max_distance)]
+            for representative, members in representatives:
+                for name in members[1:]:
+                    os.remove(os.path.join(output_dir, name))
+        save_cluster_report(os.path.join(output_dir, CLUSTERS_NAME),
+                            cluster_report(representatives, fingerprints, lambda name: name))
+    return converted, errors
+
+def find_html_files(directory_path):
     for root, dirs, files in os.walk(directory_path):
         for file in files:
             if file.endswith('.html') or file.endswith('.htm'):
-                html_file = os.path.join(root, file)
-                remove_scripts_from_file(html_file)
+                yield os.path.join(root, file)
 
+def add_href_to_directory(directory_path, new_href):
+    return _report(run_on_files(functools.partial(add_href_to_file, new_href=new_href), find_html_files(directory_path)))
 
-def remove_scripts(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
+def remove_scripts_from_directory(directory_path, sanitizer='stream', strip_handlers=True, jobs=1):
+    """Sanitize the HTML files of a directory in place, leaving alone the ones with nothing to remove;
+    returns the number of files rewritten, left untouched and failed."""
+    func = functools.partial(remove_scripts_from_file, sanitizer=sanitizer, strip_handlers=strip_handlers)
+    rewritten = 0
+
+    def count(results):
+        nonlocal rewritten
+        for file, result, error in results:
+            rewritten += bool(result)
+            yield file, result, error
+
+    converted, errors = _report(count(run_on_files(func, find_html_files(directory_path), jobs)))
+    print(f"{rewritten} files cleaned, {converted - rewritten} with nothing to remove left untouched.")
+    return rewritten, converted - rewritten, errors
+
+class HTMLScriptStripper(HTMLParser):
+    """Streaming serializer that drops <script> elements, and unsafe attributes with strip_handlers,
+    writing the same markup as BeautifulSoup with html.parser."""
+
+    VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link',
+                     'menuitem', 'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound',
+                     'command', 'frame', 'image', 'isindex', 'nextid', 'spacer'}
+    PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+    CDATA_CONTAINING_TAGS = {'script', 'style'}
+    LIST_ATTRIBUTES = {'*': {'class', 'accesskey', 'dropzone'}, 'a': {'rel', 'rev'},
+                       'link': {'rel', 'rev'}, 'td': {'headers'}, 'th': {'headers'},
+                       'form': {'accept-charset'}, 'object': {'archive'}, 'area': {'rel'},
+                       'icon': {'sizes'}, 'iframe': {'sandbox'}, 'output': {'for'}}
+    ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+    DROPPED_TAGS = {'script'}
+
+    def __init__(self, strip_handlers=False):
+        super().__init__(convert_charrefs=False)
+        self.strip_handlers = strip_handlers
+        # bs4 is imported on first use so that commands which never parse HTML start fast
+        from bs4.dammit import EntitySubstitution, UnicodeDammit
+        self.entities = EntitySubstitution
+        self.dammit = UnicodeDammit
+        self.output = []
+        self.stack = []
+        self.data = []
+        self.dropped = 0
+        self.preserve_whitespace = 0
+        self.already_closed_empty_element = []
+
+    def getvalue(self):
+        return ''.join(self.output)
+
+    def close(self):
+        super().close()
+        self.flush_data()
+        while self.stack:
+            self.pop_tag()
+
+    def write(self, markup):
+        if not self.dropped:
+            self.output.append(markup)
+
+    def collapse_whitespace(self, data):
+        if not self.preserve_whitespace and all(c in self.ASCII_SPACES for c in data):
+            return '\n' if '\n' in data else ' '
+        return data
+
+    def flush_data(self):
+        if not self.data:
+            return
+        data = self.collapse_whitespace(''.join(self.data))
+        self.data = []
+        if not self.stack or self.stack[-1] not in self.CDATA_CONTAINING_TAGS:
+            data = self.entities.substitute_xml(data)
+        self.write(data)
+
+    def format_attributes(self, tag, attrs):
+        values = {}
+        for key, value in attrs:
+            values[key] = '' if value is None else value
+        if self.strip_handlers:
+            values = {key: value for key, value in values.items() if not is_unsafe_attribute(key, value)}
+        list_attributes = self.LIST_ATTRIBUTES['*'] | self.LIST_ATTRIBUTES.get(tag, set())
+        formatted = ''
+        for key, value in sorted(values.items()):
+            if key in list_attributes:
+                value = ' '.join(re.findall(r'\S+', value))
+            value = self.entities.quoted_attribute_value(self.entities.substitute_xml(value))
+            formatted += f' {key}={value}'
+        return formatted
+
+    def push_tag(self, tag):
+        self.stack.append(tag)
+        if tag in self.PRESERVE_WHITESPACE_TAGS:
+            self.preserve_whitespace += 1
+        if tag in self.DROPPED_TAGS:
+            self.dropped += 1
+
+    def pop_tag(self):
+        tag = self.stack.pop()
+        if tag not in self.VOID_ELEMENTS:
+            self.write(f'</{tag}>')
+        if tag in self.PRESERVE_WHITESPACE_TAGS:
+            self.preserve_whitespace -= 1
+        if tag in self.DROPPED_TAGS:
+            self.dropped -= 1
+
+    def handle_starttag(self, tag, attrs, handle_empty_element=True):
+        self.flush_data()
+        void = tag in self.VOID_ELEMENTS
+        self.push_tag(tag)
+        self.write(f'<{tag}{self.format_attributes(tag, attrs)}{"/" if void else ""}>')
+        if void and handle_empty_element:
+            self.handle_endtag(tag, check_already_closed=False)
+            self.already_closed_empty_element.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, handle_empty_element=False)
+        self.handle_endtag(tag, check_already_closed=False)
+
+    def handle_endtag(self, tag, check_already_closed=True):
+        if check_already_closed and tag in self.already_closed_empty_element:
+            self.already_closed_empty_element.remove(tag)
+            return
+        self.flush_data()
+        if tag in self.stack:
+            while self.stack[-1] != tag:
+                self.pop_tag()
+            self.pop_tag()
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_charref(self, name):
+        base, digits = (16, '[0-9a-f]') if name[:1] in ('x', 'X') else (10, '[0-9]')
+        if base == 16:
+            name = name[1:]
+        # Like Beautiful Soup, keep whatever follows the number as text
+        match = re.match(f'({digits}+)(.*)', name)
+        try:
+            character = self.dammit.numeric_character_reference(int(name, base))[0]
+            extra_data = ''
+        except ValueError:
+            character = self.dammit.numeric_character_reference(int(match.group(1), base))[0] if match else ''
+            extra_data = match.group(2) if match else name
+        self.data.append(character)
+        self.data.append(extra_data)
+
+    def handle_entityref(self, name):
+        character = self.entities.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.data.append(character if character is not None else f'&{name}')
+
+    def handle_comment(self, data):
+        self.flush_data()
+        self.write(f'<!--{self.collapse_whitespace(data)}-->')
+
+    def handle_decl(self, decl):
+        self.flush_data()
+        self.write(f'<!DOCTYPE {self.collapse_whitespace(decl[len("DOCTYPE "):])}>\n')
+
+    def unknown_decl(self, data):
+        self.flush_data()
+        if data.upper().startswith('CDATA['):
+            self.write(f'<![CDATA[{self.collapse_whitespace(data[len("CDATA["):])}]]>')
+        else:
+            self.write(f'<?{self.collapse_whitespace(data)}?>')
+
+    def handle_pi(self, data):
+        self.flush_data()
+        self.write(f'<?{self.collapse_whitespace(data)}>')
+
+# URL schemes that run code once cleaned up like a browser does, in the attributes that hold a URL
+unsafe_url_schemes = ('javascript:', 'vbscript:')
+url_attributes = frozenset(('href', 'src', 'action', 'formaction', 'background', 'xlink:href', 'lowsrc', 'dynsrc',
+                            'poster', 'data', 'codebase', 'cite', 'longdesc', 'usemap', 'ping'))
+
+def is_unsafe_attribute(name, value):
+    """Whether an attribute is an on* event handler or a URL attribute with a javascript:/vbscript: URL."""
+    if not isinstance(value, str):
+        value = ' '.join(value or ())
+    name = name.lower()
+    if name.startswith('on'):
+        # A handler with no value runs nothing
+        return value != ''
+    # lxml spells namespaced attributes {namespace}name
+    if name.rpartition('}')[2] not in url_attributes and name not in url_attributes:
+        return False
+    # Browsers ignore whitespace and control characters around and inside the scheme
+    scheme = ''.join(itertools.islice((c for c in value if c > ' '), 11))
+    return scheme.lower().startswith(unsafe_url_schemes)
+
+# Anything a sanitizer could remove, including entity-encoded or split javascript: URLs
+script_hint_regex = re.compile(r'<script', re.I)
+unsafe_hint_regex = re.compile(r'<script|[\s/\'"]on[^\s/=>]*\s*=|script\s*:|&#|&(?:tab|newline|colon);', re.I)
+
+def needs_sanitizing(html_content, strip_handlers=True):
+    """Cheap check: False means html_content surely has nothing for sanitize_html to remove."""
+    regex = unsafe_hint_regex if strip_handlers else script_hint_regex
+    return regex.search(html_content) is not None
+
+def _sanitize_stream(html_content, strip_handlers):
+    stripper = HTMLScriptStripper(strip_handlers)
+    # One feed() call: html.parser recovers from broken character
+    # references differently when the document arrives in pieces
+    stripper.feed(html_content)
+    stripper.close()
+    return stripper.getvalue()
+
+def _sanitize_soup(html_content, strip_handlers, parser='html.parser'):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_content, parser)
 
     # Remove all script tags
     for script in soup(['script']):
         script.extract()
+    if strip_handlers:
+        for tag in soup.find_all(True):
+            for name in [name for name, value in tag.attrs.items() if is_unsafe_attribute(name, value)]:
+                del tag[name]
     return str(soup)
 
-def remove_scripts_from_file(html_file):
-    with open(html_file, 'r', encoding='utf-8') as file:
-        html_content = file.read()
+doctype_regex = re.compile(r'\s*(?:<!--.*?-->\s*)*<!doctype', re.I | re.S)
 
-    soup = BeautifulSoup(html_content, 'html.parser')
+def _sanitize_lxml(html_content, strip_handlers):
+    import lxml.html
+    from lxml import etree
+    try:
+        # Bytes: lxml refuses str input that carries an encoding declaration
+        document = lxml.html.document_fromstring(html_content.encode('utf-8', 'replace'),
+                                                 parser=lxml.html.HTMLParser(encoding='utf-8'))
+    except etree.ParserError:
+        # Nothing but whitespace or comments
+        return _sanitize_stream(html_content, strip_handlers)
+    for script in list(document.iter('script')):
+        script.drop_tree()
+    if strip_handlers:
+        for element in document.iter(etree.Element):
+            for name in [name for name, value in element.attrib.items() if is_unsafe_attribute(name, value)]:
+                del element.attrib[name]
+    # libxml2 reports a default doctype for documents that have none
+    doctype = document.getroottree().docinfo.doctype if doctype_regex.match(html_content) else None
+    return lxml.html.tostring(document, encoding='unicode', doctype=doctype or None)
 
-    # Remove all script tags
-    for script in soup(['script']):
-        script.extract()
+# name: (modules it needs, function(html_content, strip_handlers))
+SANITIZERS = {
+    'stream': (('bs4',), _sanitize_stream),
+    'bs4': (('bs4',), _sanitize_soup),
+    'lxml': (('lxml',), _sanitize_lxml),
+    'html5lib': (('bs4', 'html5lib'), functools.partial(_sanitize_soup, parser='html5lib')),
+}
+
+def available_sanitizers():
+    """The SANITIZERS whose modules are installed."""
+    import importlib.util
+    return [name for name, (modules, _) in SANITIZERS.items()
+            if all(importlib.util.find_spec(module) for module in modules)]
+
+def sanitize_html(html_content, sanitizer='stream', strip_handlers=True):
+    """Remove <script> elements and, if strip_handlers is True, on* attributes and javascript: URLs."""
+    with metrics.stage('strip_scripts'):
+        return SANITIZERS[sanitizer][1](html_content, strip_handlers)
+
+def remove_scripts(html_content, sanitizer='stream', strip_handlers=True):
+    return sanitize_html(html_content, sanitizer, strip_handlers)
+
+def remove_scripts_from_file(html_file, sanitizer='stream', strip_handlers=True):
+    """Sanitize an HTML file in place; return False, without writing, if there was nothing to remove."""
+    html_content = read_html(html_file, encoding='utf-8')
+    if not needs_sanitizing(html_content, strip_handlers):
+        return False
 
     # Write the modified HTML content back to the file
-    with open(html_file, 'w', encoding='utf-8') as file:
-        file.write(str(soup))
\ No newline at end of file
+    write_html(html_file, sanitize_html(html_content, sanitizer, strip_handlers), encoding='utf-8')
+    return True
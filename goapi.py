@@ -1,33 +1,297 @@
 import os
+import asyncio
 import glob
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from emlgolib import write_atomic
 from gophish import Gophish
-from gophish.models import Campaign, Group, SMTP, Template
-import pandas as pd
-import subprocess
-import tempfile
+from gophish.client import GophishClient
+from gophish.models import Campaign, Error, Group, SMTP, Template
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class PooledGophishClient(GophishClient):
+    """
+    GophishClient that keeps its connections open between requests.
+
+    The stock client calls requests.request(), which opens a new connection
+    (and TLS handshake) for every API call. This one sends everything
+    through a single Session with a pool of `workers` connections, retries
+    5xx responses, connection errors and timeouts with exponential backoff,
+    and applies a timeout to every request.
+    """
+
+    def __init__(self, api_key, host, workers=8, retries=3, backoff=0.5, timeout=30, **kwargs):
+        super().__init__(api_key, host=host.rstrip('/'), **kwargs)
+        self.timeout = timeout
+        retry_settings = dict(total=retries, backoff_factor=backoff, status_forcelist=(500, 502, 503, 504),
+                              raise_on_status=False)
+        try:
+            retry = Retry(allowed_methods=None, **retry_settings)
+        except TypeError:
+            # urllib3 < 1.26, which the gophish SDK pins, calls it method_whitelist
+            retry = Retry(method_whitelist=False, **retry_settings)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Authorization'] = f"Bearer {api_key}"
+
+    def execute(self, method, path, **kwargs):
+        kwargs.update(self._client_kwargs)
+        kwargs.setdefault('timeout', self.timeout)
+        # Depending on the SDK version the host ends with '/' and the endpoints
+        # start with one, or not; Gophish redirects '//api/...', losing the body
+        path = '/' + path.lstrip('/')
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.host.rstrip('/') + path, **kwargs)
+        except Exception:
+            metrics.record_request(method, path, 'error', time.perf_counter() - start)
+            raise
+        # Retries happen inside session.request, so this is the latency the caller sees
+        metrics.record_request(method, path, response.status_code, time.perf_counter() - start)
+        return response
+
+email_regex = r'[^@\s]+@[^@\s]+\.[^@\s]+'
+
+INDEX_CACHE_DIR = os.path.expanduser('~/.cache/emlgo')
+
+# How far down the funnel each result status is
+STATUS_RANK = {
+    "Email Sent": 1,
+    "Email Opened": 2,
+    "Clicked Link": 3,
+    "Submitted Data": 4,
+}
+FUNNEL = ["sent", "opened", "clicked", "submitted"]
+
+class ResourceIndex:
+    """
+    Name and ID lookup for the groups, templates, pages and SMTP profiles of a Gophish server.
+
+    Each resource type is listed once and kept for `ttl` seconds, so repeated
+    lookups do not download the whole list again. When CampaignManager
+    creates or deletes a resource it drops the type from the index, except
+    for templates uploaded by _send_template, which are added to it.
+    If cache_file is given the index is also saved there and reused by later
+    runs while it is fresh; only the id and name of each resource are written,
+    so objects loaded from the file carry nothing else.
+    """
+
+    RESOURCE_TYPES = ('groups', 'templates', 'pages', 'smtp')
+
+    def __init__(self, client, ttl=300, cache_file=None):
+        self.client = client
+        self.ttl = ttl
+        self.cache_file = cache_file
+        self.entries = {}
+        # Reentrant: a refresh holds it while it saves
+        self.lock = threading.RLock()
+        if cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as file:
+                    for resource_type, entry in json.load(file).items():
+                        self._store(resource_type, entry['items'], entry['fetched'])
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Ignoring unreadable index cache {cache_file}: {e}")
+
+    def _store(self, resource_type, items, fetched):
+        parse = getattr(self.client, resource_type)._cls.parse
+        resources = [parse(item) for item in items]
+        self.entries[resource_type] = {
+            "fetched": fetched,
+            "items": [{"id": item.get("id"), "name": item.get("name")} for item in items],
+            "by_name": {resource.name: resource for resource in reversed(resources)},
+            "by_id": {resource.id: resource for resource in resources},
+        }
+
+    def _entry(self, resource_type):
+        # Locked, so that concurrent lookups of a type missing from the index download its list once
+        with self.lock:
+            entry = self.entries.get(resource_type)
+            if entry is None or time.time() - entry["fetched"] > self.ttl:
+                api = getattr(self.client, resource_type)
+                response = self.client.client.execute("GET", api.endpoint)
+                if not response.ok:
+                    raise Error.parse(response.json())
+                self._store(resource_type, response.json(), time.time())
+                self.save()
+                entry = self.entries[resource_type]
+            return entry
+
+    def find(self, resource_type, name=None, id=None):
+        """Return the resource with the given name (or id), or None."""
+        entry = self._entry(resource_type)
+        if id is not None:
+            return entry["by_id"].get(id)
+        return entry["by_name"].get(name)
+
+    def remember(self, resource_type, item):
+        """Add a resource just created to the index, if its type is loaded, instead of listing the type again."""
+        with self.lock:
+            entry = self.entries.get(resource_type)
+            if entry is None:
+                return
+            resource = getattr(self.client, resource_type)._cls.parse(item)
+            entry["items"].append({"id": item.get("id"), "name": item.get("name")})
+            entry["by_name"].setdefault(resource.name, resource)
+            entry["by_id"][resource.id] = resource
+            self.save()
+
+    def invalidate(self, resource_type=None):
+        with self.lock:
+            if resource_type is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(resource_type, None)
+        self.save()
+
+    def save(self):
+        if not self.cache_file:
+            return
+        with self.lock:
+            data = {resource_type: {"fetched": entry["fetched"], "items": entry["items"]}
+                    for resource_type, entry in self.entries.items()}
+            try:
+                os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+                write_atomic(self.cache_file, json.dumps(data))
+            except OSError as e:
+                # The cache only saves time: the request that changed the server still succeeded
+                print(f"Could not save the index cache {self.cache_file}: {e}")
+
+class CampaignStore:
+    """
+    Local SQLite snapshot of the results and timeline events of Gophish campaigns.
+
+    Results are keyed by campaign and result ID and replaced when they change;
+    events are keyed by campaign and a hash of their content, so merging the
+    same timeline twice adds nothing. CampaignManager.update_store fills it.
+    """
+
+    RESULT_FIELDS = ('email', 'first_name', 'last_name', 'position', 'status', 'reported',
+                     'ip', 'latitude', 'longitude', 'send_date', 'modified_date')
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(INDEX_CACHE_DIR, 'campaigns.sqlite')
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS campaigns (
+                id INTEGER PRIMARY KEY, name TEXT, status TEXT, launch_date TEXT, stats TEXT);
+            CREATE TABLE IF NOT EXISTS results (
+                campaign_id INTEGER, id TEXT, {', '.join(self.RESULT_FIELDS)},
+                PRIMARY KEY (campaign_id, id));
+            CREATE TABLE IF NOT EXISTS events (
+                campaign_id INTEGER, id TEXT, email TEXT, time TEXT, message TEXT, details TEXT,
+                PRIMARY KEY (campaign_id, id));
+        """)
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def _stats(campaign):
+        return json.dumps([campaign.get("status"), campaign.get("stats")], sort_keys=True)
+
+    def needs_fetch(self, campaign):
+        """
+        Whether the results of the campaign (an entry of /api/campaigns/summary) must be downloaded.
+
+        The stats count targets per status, not events: a second open or click
+        by the same target leaves them as they were. So a campaign that is not
+        completed is always fetched; a completed one only if it changed since
+        it was stored, since Gophish records nothing more for it.
+        """
+        if campaign.get("status") != "Completed":
+            return True
+        row = self.db.execute("SELECT stats FROM campaigns WHERE id = ?", (campaign["id"],)).fetchone()
+        return row is None or row[0] != self._stats(campaign)
+
+    def merge(self, campaign, results, timeline):
+        """Store the campaign's results and add its new events; return how many events were new."""
+        with self.db:
+            before = self.db.total_changes
+            self.db.executemany(
+                "INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?)",
+                ((campaign["id"], self._event_id(event), event.get("email"), event.get("time"),
+                  event.get("message"), event.get("details")) for event in timeline))
+            new_events = self.db.total_changes - before
+            self.db.executemany(
+                f"INSERT OR REPLACE INTO results VALUES ({', '.join('?' * (len(self.RESULT_FIELDS) + 2))})",
+                ((campaign["id"], result.get("id"), *(result.get(field) for field in self.RESULT_FIELDS))
+                 for result in results))
+            self.db.execute("INSERT OR REPLACE INTO campaigns VALUES (?, ?, ?, ?, ?)",
+                            (campaign["id"], campaign.get("name"), campaign.get("status"),
+                             campaign.get("launch_date"), self._stats(campaign)))
+        return new_events
+
+    @staticmethod
+    def _event_id(event):
+        key = json.dumps([event.get("email"), event.get("time"), event.get("message"), event.get("details")])
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def remove_missing(self, campaign_ids):
+        """Forget the campaigns that are not in campaign_ids any more."""
+        keep = set(campaign_ids)
+        gone = [(campaign_id,) for (campaign_id,) in self.db.execute("SELECT id FROM campaigns")
+                if campaign_id not in keep]
+        with self.db:
+            for table, column in (("campaigns", "id"), ("results", "campaign_id"), ("events", "campaign_id")):
+                self.db.executemany(f"DELETE FROM {table} WHERE {column} = ?", gone)
+
+    def summaries(self, campaign_ids=None):
+        """Return the stored campaigns in the same form as CampaignManager.get_campaigns_details."""
+        campaigns = self.db.execute("SELECT id, name, status, launch_date FROM campaigns ORDER BY id").fetchall()
+        if campaign_ids is not None:
+            wanted = set(campaign_ids)
+            campaigns = [campaign for campaign in campaigns if campaign[0] in wanted]
+        summaries = []
+        for campaign_id, name, status, launch_date in campaigns:
+            rows = self.db.execute(
+                f"SELECT id, {', '.join(self.RESULT_FIELDS)} FROM results WHERE campaign_id = ?", (campaign_id,))
+            results = [dict(zip(("id",) + self.RESULT_FIELDS, row)) for row in rows]
+            summaries.append({"id": campaign_id, "name": name, "status": status,
+                              "launch_date": launch_date, "results": results})
+        return summaries
+
+    def timeline(self, campaign_id):
+        """Return the stored events of a campaign in time order."""
+        rows = self.db.execute("SELECT email, time, message, details FROM events WHERE campaign_id = ? ORDER BY time",
+                               (campaign_id,))
+        return [dict(zip(("email", "time", "message", "details"), row)) for row in rows]
 
 class CampaignManager:
-    def __init__(self, url: str, api_key: str):
+    def __init__(self, url: str, api_key: str, workers: int = 8, index_ttl: int = 300, persist_index: bool = False):
         import urllib3
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        self.client = Gophish(api_key, host=url, verify=False)
+        self.client = Gophish(api_key, host=url, client=PooledGophishClient, verify=False, workers=workers)
         self.url = url
         self.api_key = api_key
+        self.workers = workers
+        index_file = None
+        if persist_index:
+            server = hashlib.sha256(f"{url}\0{api_key}".encode()).hexdigest()[:16]
+            index_file = os.path.join(INDEX_CACHE_DIR, f"index-{server}.json")
+        self.index = ResourceIndex(self.client, ttl=index_ttl, cache_file=index_file)
     
     def check_existence(self, resource_type, name):
         """
             Check if a resource with a given name exists on the Gophish server.
+            Lookups go through self.index, so the list is only downloaded once per TTL.
             
             param resource_type: The type of resource to check (e.g., 'groups', 'templates').
             param name: The name of the resource to check.
             return: The resource object if found, otherwise None.
         """
         try:
-            resources = getattr(self.client, resource_type).list()
-            for resource in resources:
-                if resource.name == name:
-                    return resource
-            return None
+            return self.index.find(resource_type, name)
         except Exception as e:
             print(f"Error checking existence of {resource_type}: {e}")
             return None
@@ -62,73 +326,232 @@ class CampaignManager:
             print(f"Error fetching campaigns summaries: {e}")
             return None
 
-    def create_group(self, group_name, file):
+    def read_targets(self, file, chunksize=50000):
         """
-        Create a new group on the Gophish server using the provided CSV file.
+        Read the targets of a group from a CSV file with columns First Name, Last Name, Email and optionally Position.
+
+        The file is read chunksize rows at a time and cleaned with vectorized
+        pandas operations: values are stripped, rows with a missing or invalid
+        email are skipped, and an email already seen (case-insensitive) is dropped.
 
-        :param group_name: The name of the group to create.
         :param file: Path to the CSV file containing the target information.
-        :return: The created group object or None if creation fails.
+        :param chunksize: Number of rows read at once.
+        :return: The list of target dicts, or None if a required column is missing.
         """
-        df = pd.read_csv(file)
-
-        # Check for required columns: email, first_name, last_name
+        import pandas as pd
         required_columns = ['First Name','Last Name','Email']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            print(f"Missing required columns: {', '.join(missing_columns)}")
-            return None
-
-        # Create a list to hold the target data
+        columns = required_columns + ['Position']
         targets = []
+        seen = set()
+        missing_email = invalid_email = duplicates = 0
+
+        chunks = pd.read_csv(file, dtype=str, keep_default_na=False, chunksize=chunksize,
+                             usecols=lambda col: col in columns)
+        for df in chunks:
+            # Check for required columns: email, first_name, last_name
+            missing_columns = [col for col in required_columns if col not in df.columns]
+            if missing_columns:
+                print(f"Missing required columns: {', '.join(missing_columns)}")
+                return None
+            if 'Position' not in df.columns:
+                df['Position'] = ''  # position is optional
+            df = df[columns].apply(lambda col: col.str.strip())
+
+            # Skip rows without a valid email and emails seen before
+            has_email = df['Email'] != ''
+            valid = df['Email'].str.fullmatch(email_regex)
+            missing_email += int((~has_email).sum())
+            invalid_email += int((has_email & ~valid).sum())
+            df = df[valid]
+            keys = df['Email'].str.lower()
+            unique = ~keys.duplicated() & ~keys.isin(seen)
+            duplicates += int((~unique).sum())
+            df = df[unique]
+            seen.update(keys[unique])
+
+            for first_name, last_name, email, position in zip(*(df[col].tolist() for col in columns)):
+                target = {
+                    'first_name': first_name,
+                    'last_name': last_name,
+                    'email': email
+                }
+                if position:  # Only add position if it's not empty
+                    target['position'] = position
+                targets.append(target)
+
+        for count, reason in ((missing_email, "a missing email"), (invalid_email, "an invalid email"),
+                              (duplicates, "a duplicate email")):
+            if count:
+                print(f"Skipped {count} rows with {reason}.")
+        return targets
+
+    def _post_group(self, name, targets):
+        # Raw JSON rather than the Group model: no per-target objects for large groups
+        response = self.client.client.execute("POST", "api/groups/", json={"name": name, "targets": targets})
+        if not response.ok:
+            raise Error.parse(response.json())
+        self.index.invalidate("groups")
+        return Group.parse(response.json())
+
+    def _campaign_list(self):
+        response = self.client.client.execute("GET", "api/campaigns/summary")
+        if not response.ok:
+            raise Error.parse(response.json())
+        return response.json().get("campaigns") or []
+
+    async def _fetch_campaigns(self, campaign_ids, concurrency, suffix=""):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(campaign_id, executor):
+            async with semaphore:
+                response = await loop.run_in_executor(
+                    executor, lambda: self.client.client.execute("GET", f"api/campaigns/{campaign_id}{suffix}"))
+            if not response.ok:
+                raise Error.parse(response.json())
+            return response.json()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return await asyncio.gather(*(fetch(campaign_id, executor) for campaign_id in campaign_ids),
+                                        return_exceptions=True)
+
+    def get_campaigns_details(self, campaign_ids=None, concurrency=None):
+        """
+        Fetch the full results of several campaigns concurrently.
 
-        # Iterate over the DataFrame and prepare the target data
-        for _, row in df.iterrows():
-            email = row['Email'].strip()
-            first_name = row['First Name'].strip()
-            last_name = row['Last Name'].strip()
+        :param campaign_ids: IDs of the campaigns to fetch; all campaigns if None.
+        :param concurrency: Maximum number of requests in flight (defaults to self.workers).
+        :return: A list of summaries like get_campaign_summary's, or None if listing the campaigns fails.
+        """
+        try:
+            if campaign_ids is None:
+                campaign_ids = [campaign["id"] for campaign in self._campaign_list()]
+            campaigns = asyncio.run(self._fetch_campaigns(campaign_ids, concurrency or self.workers))
+        except Exception as e:
+            print(f"Error fetching campaigns summaries: {e}")
+            return None
 
-            # Handle 'position' safely
-            position = row.get('Position', '')  # position is optional
-            
-            # If position is a float (NaN), convert to empty string
-            if isinstance(position, float) and pd.isna(position):
-                position = ''
+        summaries = []
+        for campaign_id, campaign in zip(campaign_ids, campaigns):
+            if isinstance(campaign, Exception):
+                print(f"Error fetching campaign {campaign_id}: {campaign}")
+                continue
+            summaries.append({
+                "id": campaign["id"],
+                "name": campaign["name"],
+                "status": campaign["status"],
+                "launch_date": campaign["launch_date"],
+                "results": campaign.get("results") or [],
+            })
+        return summaries
+
+    def update_store(self, store, campaign_ids=None, concurrency=None):
+        """
+        Bring a CampaignStore up to date with the server.
+
+        The campaigns are listed in a single request. The results and
+        timeline of the campaigns that are not completed are downloaded
+        again, since Gophish cannot send only the events after a given time,
+        and those of completed campaigns only until the store has them in
+        their final state. Only the events the store does not have yet are
+        added.
+
+        :param store: The CampaignStore to update.
+        :param campaign_ids: IDs of the campaigns to follow; all campaigns if None.
+        :param concurrency: Maximum number of requests in flight (defaults to self.workers).
+        :return: A dict with the number of campaigns checked and fetched and of new events,
+                 or None if the campaigns could not be listed.
+        """
+        try:
+            campaigns = self._campaign_list()
+        except Exception as e:
+            print(f"Error fetching campaigns summaries: {e}")
+            return None
+        if campaign_ids is not None:
+            wanted = set(campaign_ids)
+            campaigns = [campaign for campaign in campaigns if campaign["id"] in wanted]
+        else:
+            store.remove_missing(campaign["id"] for campaign in campaigns)
 
-            # Ensure position is a string (even if it's None or NaN)
-            position = str(position).strip()
+        stale = [campaign for campaign in campaigns if store.needs_fetch(campaign)]
+        details = asyncio.run(self._fetch_campaigns(
+            [campaign["id"] for campaign in stale], concurrency or self.workers, suffix="/results"))
 
-            # Skip rows without a valid email
-            if not email:
-                print(f"Skipping row with missing email: {first_name} {last_name}")
+        new_events = 0
+        for campaign, detail in zip(stale, details):
+            if isinstance(detail, Exception):
+                print(f"Error fetching campaign {campaign['id']}: {detail}")
                 continue
+            new_events += store.merge(campaign, detail.get("results") or [], detail.get("timeline") or [])
+        return {"checked": len(campaigns), "fetched": len(stale), "new_events": new_events}
 
-            # Create a target dictionary (position is optional)
-            target = {
-                'first_name': first_name,
-                'last_name': last_name,
-                'email': email
-            }
-            if position:  # Only add position if it's not empty
-                target['position'] = position
+    @staticmethod
+    def campaign_funnel(summaries):
+        """
+        Count how many targets of each campaign were sent the email, opened it,
+        clicked, submitted data and reported it, plus a 'total' row.
+
+        A result counts for every step up to its status, so a target who
+        submitted data also counts as sent, opened and clicked.
 
-            # Add the target to the list
-            targets.append(target)
+        :param summaries: Campaign summaries with results (see get_campaigns_details).
+        :return: A DataFrame indexed by campaign ID, with the campaign name as a column;
+                 campaigns without results have a row of zeros.
+        """
+        import pandas as pd
+        columns = ["targets", *FUNNEL, "reported"]
+        results = pd.DataFrame(
+            [(summary["id"], STATUS_RANK.get(result.get("status"), 0), bool(result.get("reported")))
+             for summary in summaries for result in summary["results"]],
+            columns=["id", "rank", "reported"])
+        counts = pd.DataFrame({"id": results["id"], "targets": 1}, columns=["id", *columns])
+        for step, name in enumerate(FUNNEL, start=1):
+            counts[name] = results["rank"] >= step
+        counts["reported"] = results["reported"]
+        # By ID: Gophish allows several campaigns with the same name, or named 'total'
+        ids = pd.Index([summary["id"] for summary in summaries], name="id")
+        funnel = counts.groupby("id").sum().reindex(ids, fill_value=0).astype(int)
+        funnel.insert(0, "name", [summary["name"] for summary in summaries])
+        total = pd.DataFrame([["", *funnel[columns].sum()]], columns=funnel.columns,
+                             index=pd.Index(["total"], name="id")).astype({name: int for name in columns})
+        return pd.concat([funnel, total])
+
+    def create_group(self, group_name, file, group_size=None):
+        """
+        Create a new group on the Gophish server using the provided CSV file.
+
+        :param group_name: The name of the group to create.
+        :param file: Path to the CSV file containing the target information.
+        :param group_size: If given and the file has more targets, split them into groups of at most
+            group_size targets named "<group_name> 1", "<group_name> 2", ... and post them concurrently.
+        :return: The created group object (a list of them if split) or None if creation fails.
+        """
+        targets = self.read_targets(file)
 
         # Check if there are valid targets to create the group
-        if targets:
-            # Create the group using the Gophish Group model
-            group = Group(name=group_name, targets=targets)
+        if not targets:
+            print("No valid targets to create a group.")
+            return None
 
+        if not group_size or len(targets) <= group_size:
             # Send the group creation request to the Gophish server
-            response = self.client.groups.post(group)
+            response = self._post_group(group_name, targets)
             print(f"Group created successfully with Name: {response.name}")
             # Return the created group object
             return response
-        else:
-            print("No valid targets to create a group.")
-            return None
 
+        chunks = [targets[i:i + group_size] for i in range(0, len(targets), group_size)]
+        names = [f"{group_name} {i}" for i in range(1, len(chunks) + 1)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._post_group, name, chunk) for name, chunk in zip(names, chunks)]
+        groups = []
+        for name, future in zip(names, futures):
+            try:
+                groups.append(future.result())
+                print(f"Group created successfully with Name: {name}")
+            except Exception as e:
+                print(f"Error creating group '{name}': {e}")
+        return groups
 
     def delete_all_templates(self):
         """
@@ -149,116 +572,217 @@ class CampaignManager:
                 try:
                     # Delete the template
                     self.client.templates.delete(template.id)
+                    self.index.invalidate("templates")
                     print(f"Template '{template.name}' with ID {template.id} deleted successfully.")
                 except Exception as e:
                     print(f"Error deleting template '{template.name}': {e}")
         except Exception as e:
             print(f"Error fetching templates: {e}")
 
-    import requests
-
     def _get_url(self):
         return self.url
     def _get_api(self):
         return self.api_key
-        
+
+    def _send_template(self, html_path, name, template=None):
+        """
+        Upload a single HTML file as a template.
+
+        :param template: Server template (dict) to overwrite in place with PUT; created with POST if None.
+        :return: A dict with the file, the template name and either its id or the error.
+        """
+        result = {"file": html_path, "name": name}
+        try:
+            with open(html_path, 'r') as file:
+                html_body = file.read()
+            if template:
+                payload = dict(template, subject=name, html=html_body)
+                response = self.client.client.execute("PUT", f"api/templates/{template['id']}", json=payload)
+            else:
+                payload = {
+                    "name": name,
+                    "subject": name,
+                    "text": "",
+                    "html": html_body
+                }
+                response = self.client.client.execute("POST", "api/templates/", json=payload)
+            if response.ok:
+                result["id"] = response.json().get("id", template and template['id'])
+                if not template:
+                    # An update keeps the name and ID: only a new template changes the index
+                    self.index.remember("templates", response.json())
+            else:
+                result["error"] = f"HTTP {response.status_code}: {response.text.strip()}"
+        except Exception as e:
+            result["error"] = str(e)
+        return result
+
+    def _delete_template(self, template):
+        result = {"file": None, "name": template['name'], "id": template['id']}
+        try:
+            response = self.client.client.execute("DELETE", f"api/templates/{template['id']}")
+            if response.ok:
+                self.index.invalidate("templates")
+            else:
+                result["error"] = f"HTTP {response.status_code}: {response.text.strip()}"
+        except Exception as e:
+            result["error"] = str(e)
+        return result
+
+    @staticmethod
+    def template_name(html_path):
+        """Name of the template of an HTML file: its file name without the first 9 and last 11 characters."""
+        return os.path.basename(html_path)[9:-11]
+
+    def _html_templates(self, directory):
+        """Map template names to the HTML files of a directory, named as create_template names them."""
+        return {self.template_name(html_file): os.path.join(directory, html_file)
+                for html_file in sorted(os.listdir(directory)) if html_file.endswith('.html')}
+
     def create_template(self, html_source, directory=False):
-        import json
         """
-        Create a new template in Gophish using an HTML file or all HTML files from a directory using curl.
+        Create a new template in Gophish using an HTML file or all HTML files from a directory.
+
+        Files are uploaded concurrently (self.workers at a time) over the pooled
+        client connection; a failing file does not stop the others.
 
         :param html_source: The HTML file or directory containing HTML files.
         :param directory: If True, treats html_source as a directory and reads all HTML files in it.
-        :return: None if creation fails, otherwise prints the success message.
+        :return: A list of per-template results (see _send_template), or None if html_source is invalid.
         """
-        try:
-            gophish_url = self._get_url()  # Gophish API URL
-            api_key = self._get_api()  # Gophish API Key
-            
-            # If directory is specified, read all HTML files from the directory
-            if directory:
-                if not os.path.isdir(html_source):
-                    print(f"Provided path '{html_source}' is not a valid directory.")
-                    return None
+        # If directory is specified, read all HTML files from the directory
+        if directory:
+            if not os.path.isdir(html_source):
+                print(f"Provided path '{html_source}' is not a valid directory.")
+                return None
+
+            # Collect all HTML files from the directory
+            html_files = [f for f in os.listdir(html_source) if f.endswith('.html')]
+            if not html_files:
+                print(f"No HTML files found in directory: {html_source}")
+                return None
+            uploads = [(os.path.join(html_source, html_file), self.template_name(html_file)) for html_file in html_files]
+        else:
+            # Read HTML content from a single file if directory is not specified
+            if not os.path.isfile(html_source):
+                print(f"Provided path '{html_source}' is not a valid file.")
+                return None
+            uploads = [(html_source, self.template_name(html_source))]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(lambda upload: self._send_template(*upload), uploads))
+
+        for result in results:
+            if "error" in result:
+                print(f"Error creating template '{os.path.basename(result['file'])}': {result['error']}")
+            else:
+                print(f"Template '{os.path.basename(result['file'])}' created successfully.")
+        return results
 
-                # Collect all HTML files from the directory
-                html_files = [f for f in os.listdir(html_source) if f.endswith('.html')]
-                if not html_files:
-                    print(f"No HTML files found in directory: {html_source}")
-                    return None
+    def sync_templates(self, directory):
+        """
+        Make the templates on the Gophish server match the HTML files of a directory.
 
-                # Create templates for each HTML file in the directory
-                for html_file in html_files:
-                    html_path = os.path.join(html_source, html_file)
-                    with open(html_path, 'r') as file:
-                        html_body = file.read()
-                    
-                    # Prepare the payload
-                    payload = {
-                        "name": html_file[9:-11],
-                        "subject": html_file[9:-11],
-                        "text": "",
-                        "html": html_body
-                    }
-
-                    # Convert the payload to JSON
-                    payload_json = json.dumps(payload)
-                    with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8') as temp_file:
-                        temp_file.write(payload_json)
-                        temp_filename = temp_file.name
-                    curl_command = [
-                    "curl", "-X", "POST",
-                    "-H", "Content-Type: application/json",
-                    "-d", "@{temp_filename}",
-                    "-k" ,f"{gophish_url}api/templates/?api_key={api_key}"
-                    ]
-                    
-                    # Execute the curl command
-                    result = subprocess.run(curl_command, capture_output=True, text=True)
-
-                    # Check the result
-                    if result.returncode == 0:
-                        print(f"Template '{html_file}' created successfully.")
-                    else:
-                        print(f"Error creating template: {result.stderr}")
+        The server list is fetched once and compared by name and by a hash of
+        the subject and HTML: only missing templates are created, changed ones
+        are updated in place (so they keep their ID and the campaigns using
+        them), and templates with no local file are deleted. The requests are
+        sent concurrently.
+
+        :param directory: Directory containing the HTML files.
+        :return: A dict mapping 'created', 'updated', 'deleted' and 'unchanged' to per-template results.
+        """
+        if not os.path.isdir(directory):
+            print(f"Provided path '{directory}' is not a valid directory.")
+            return None
+        local = self._html_templates(directory)
+        response = self.client.client.execute("GET", "api/templates/")
+        if not response.ok:
+            print(f"Error fetching templates: HTTP {response.status_code}: {response.text.strip()}")
+            return None
+
+        def digest(subject, html):
+            return hashlib.sha256(f"{subject}\0{html}".encode('utf-8', 'surrogateescape')).hexdigest()
+
+        server = {}
+        duplicates = []
+        for template in response.json():
+            if template['name'] in server:
+                duplicates.append(template)
             else:
-                # Read HTML content from a single file if directory is not specified
-                if not os.path.isfile(html_source):
-                    print(f"Provided path '{html_source}' is not a valid file.")
-                    return None
+                server[template['name']] = template
+
+        tasks = []
+        unchanged = []
+        for name, html_path in local.items():
+            template = server.get(name)
+            if template is None:
+                tasks.append(('created', lambda path=html_path, name=name: self._send_template(path, name)))
+                continue
+            with open(html_path, 'r') as file:
+                html_body = file.read()
+            if digest(name, html_body) == digest(template.get('subject'), template.get('html')):
+                unchanged.append({"file": html_path, "name": name, "id": template['id']})
+            else:
+                tasks.append(('updated', lambda path=html_path, name=name, template=template: self._send_template(path, name, template)))
+        for template in [t for name, t in server.items() if name not in local] + duplicates:
+            tasks.append(('deleted', lambda template=template: self._delete_template(template)))
 
-                with open(html_source, 'r') as file:
-                    html_body = file.read()
+        results = {'created': [], 'updated': [], 'deleted': [], 'unchanged': unchanged}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for (action, _), result in zip(tasks, executor.map(lambda task: task[1](), tasks)):
+                results[action].append(result)
+                if "error" in result:
+                    print(f"Error syncing template '{result['name']}': {result['error']}")
 
-                # Prepare the payload
-                payload = {
-                    "name": os.path.basename(html_source)[9:-11],
-                    "subject": os.path.basename(html_source)[9:-11],
-                    "text": "",
-                    "html": html_body
-                }
+        print(", ".join(f"{len(results[action])} {action}" for action in results))
+        return results
+
+    def publish_templates(self, html_paths):
+        """
+        Create or update the templates of the given HTML files, and only those.
 
-                # Convert the payload to JSON
-                payload_json = json.dumps(payload)
-                with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8') as temp_file:
-                    temp_file.write(payload_json)
-                    temp_filename = temp_file.name
-                curl_command = [
-                "curl", "-X", "POST",
-                "-H", "Content-Type: application/json",
-                "-d", "@{temp_filename}",
-                "-k" ,f"{gophish_url}api/templates/?api_key={api_key}"
-                ]
-                # Execute the curl command
-                result = subprocess.run(curl_command, capture_output=True, text=True)
-                # Check the result
-                if result.returncode == 0:
-                    print(f"Template '{os.path.basename(html_source)}' created successfully.")
-                else:
-                    print(f"Error creating template: {result.stderr}")
+        Templates are named as create_template names them and looked up in the
+        resource index, so the server list is not downloaded for every call;
+        only the templates with a matching name are fetched and compared. A
+        template that already exists is updated in place, so it keeps its ID
+        and the campaigns using it. The uploads run concurrently.
 
+        :param html_paths: HTML files to publish.
+        :return: A dict mapping 'created', 'updated' and 'unchanged' to per-template results, or None on error.
+        """
+        try:
+            tasks = [(html_path, self.template_name(html_path)) for html_path in html_paths]
+            tasks = [(html_path, name, self.index.find("templates", name)) for html_path, name in tasks]
         except Exception as e:
-            print(f"Error creating template: {e}")
+            print(f"Error fetching templates: {e}")
+            return None
+
+        results = {'created': [], 'updated': [], 'unchanged': []}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for action, result in executor.map(lambda task: self._publish_template(*task), tasks):
+                results[action].append(result)
+                if "error" in result:
+                    print(f"Error publishing template '{result['name']}': {result['error']}")
+        return results
+
+    def _publish_template(self, html_path, name, template=None):
+        """Compare one HTML file with its template, if any, and send it if they differ; returns (action, result)."""
+        if template is not None:
+            response = self.client.client.execute("GET", f"api/templates/{template.id}")
+            if response.ok:
+                template = response.json()
+                with open(html_path, 'r') as file:
+                    html_body = file.read()
+                if template.get('html') == html_body and template.get('subject') == name:
+                    return 'unchanged', {"file": html_path, "name": name, "id": template['id']}
+                return 'updated', self._send_template(html_path, name, template)
+            if response.status_code != 404:
+                return 'updated', {"file": html_path, "name": name,
+                                   "error": f"HTTP {response.status_code}: {response.text.strip()}"}
+            # Deleted since the index listed it
+            self.index.invalidate("templates")
+        return 'created', self._send_template(html_path, name)
 
     def create_templatesksksks(self, html_source, directory=False):
         """
@@ -293,6 +817,7 @@ class CampaignManager:
                     
                     # Post the template to Gophish
                     response = self.client.templates.post(new_template)
+                    self.index.invalidate("templates")
                     print(f"Template created successfully with ID: {response.id}")
                     created_templates.append(response)
                 
@@ -311,6 +836,7 @@ class CampaignManager:
 
                 # Create template on Gophish
                 response = self.client.templates.post(new_template)
+                self.index.invalidate("templates")
                 print(f"Template created successfully with ID: {response.id}")
                 return response
 
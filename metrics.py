@@ -0,0 +1,298 @@
+"""
+Stage timings, per-file latencies, byte counts and HTTP request stats of an emlgo run.
+
+Nothing is recorded until enable() is called, so the hooks in emlgolib and
+goapi cost next to nothing on normal runs.
+"""
+import bisect
+import contextlib
+import heapq
+import json
+import marshal
+import os
+import re
+import threading
+import time
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics = None
+_lock = threading.Lock()
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (the max for the last bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'max': round(self.max, 6),
+            'p50': round(self.quantile(0.5), 6),
+            'p90': round(self.quantile(0.9), 6),
+            'p99': round(self.quantile(0.99), 6),
+            'buckets': {str(bound): count for bound, count in zip(BUCKETS + ('+Inf',), self.counts)},
+        }
+
+class Metrics:
+    """
+    Everything recorded during a run.
+
+    Worker processes record into their own Metrics, which are sent back and
+    merged into the parent's. The `slowest` slowest files are remembered;
+    if profile is True each file runs under cProfile and their profiles are
+    kept too.
+    """
+
+    def __init__(self, slowest=5, profile=False):
+        self.started = time.perf_counter()
+        self.slowest_count = slowest
+        self.profile = profile
+        self.stages = {}
+        self.files = Histogram()
+        self.slowest = []
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.requests = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            with _lock:
+                stage = self.stages.setdefault(name, [0, 0.0, 0.0])
+                stage[0] += 1
+                stage[1] += wall
+                stage[2] += cpu
+
+    def record_file(self, file, seconds, profile=None):
+        self.files.observe(seconds)
+        self._keep_if_slow((seconds, file, profile))
+
+    def _keep_if_slow(self, entry):
+        # A min-heap of (seconds, file, marshalled pstats or None), at most slowest_count long
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest and entry[0] > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def record_request(self, method, path, status, seconds):
+        # /api/templates/12 and /api/templates/13 are the same endpoint
+        endpoint = re.sub(r'/\d+(?=/|$)', '/{id}', path.split('?')[0].rstrip('/')) or '/'
+        with _lock:
+            entry = self.requests.setdefault((method, endpoint), {'statuses': {}, 'latency': Histogram()})
+            entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+            entry['latency'].observe(seconds)
+
+    def merge(self, other):
+        for name, (calls, wall, cpu) in other.stages.items():
+            stage = self.stages.setdefault(name, [0, 0.0, 0.0])
+            stage[0] += calls
+            stage[1] += wall
+            stage[2] += cpu
+        self.files.merge(other.files)
+        for entry in other.slowest:
+            self._keep_if_slow(entry)
+        self.bytes_read += other.bytes_read
+        self.bytes_written += other.bytes_written
+        for key, entry in other.requests.items():
+            mine = self.requests.setdefault(key, {'statuses': {}, 'latency': Histogram()})
+            for status, count in entry['statuses'].items():
+                mine['statuses'][status] = mine['statuses'].get(status, 0) + count
+            mine['latency'].merge(entry['latency'])
+
+    def to_dict(self):
+        return {
+            'wall_seconds': round(time.perf_counter() - self.started, 6),
+            'stages': {name: {'calls': calls, 'wall_seconds': round(wall, 6), 'cpu_seconds': round(cpu, 6)}
+                       for name, (calls, wall, cpu) in self.stages.items()},
+            'files': self.files.to_dict(),
+            'slowest_files': [{'file': file, 'seconds': round(seconds, 6)}
+                              for seconds, file, _ in sorted(self.slowest, reverse=True)],
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'http_requests': [{'method': method, 'endpoint': endpoint,
+                               'statuses': {str(status): count for status, count in entry['statuses'].items()},
+                               'latency': entry['latency'].to_dict()}
+                              for (method, endpoint), entry in sorted(self.requests.items())],
+        }
+
+    def to_prometheus(self):
+        """The metrics in the Prometheus text format, e.g. for the node_exporter textfile collector."""
+        lines = []
+
+        def label_text(labels):
+            if not labels:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for value in labels.values())
+            return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{label_text(labels)} {value}')
+
+        def histogram(name, help_text, histograms):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for labels, histogram in histograms:
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{label_text({**labels, "le": bound})} {cumulative}')
+                lines.append(f'{name}_sum{label_text(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{label_text(labels)} {histogram.count}')
+
+        stages = sorted(self.stages.items())
+        metric('emlgo_stage_wall_seconds_total', 'counter', 'Wall-clock seconds spent in each stage.',
+               [({'stage': name}, wall) for name, (calls, wall, cpu) in stages])
+        metric('emlgo_stage_cpu_seconds_total', 'counter', 'CPU seconds spent in each stage.',
+               [({'stage': name}, cpu) for name, (calls, wall, cpu) in stages])
+        metric('emlgo_stage_calls_total', 'counter', 'Times each stage ran.',
+               [({'stage': name}, calls) for name, (calls, wall, cpu) in stages])
+        histogram('emlgo_file_seconds', 'Seconds spent converting each file.', [({}, self.files)])
+        metric('emlgo_read_bytes_total', 'counter', 'Bytes read from input files.', [({}, self.bytes_read)])
+        metric('emlgo_written_bytes_total', 'counter', 'Bytes written to output files.', [({}, self.bytes_written)])
+        requests = sorted(self.requests.items())
+        metric('emlgo_http_requests_total', 'counter', 'HTTP requests to the Gophish server.',
+               [({'method': method, 'endpoint': endpoint, 'status': status}, count)
+                for (method, endpoint), entry in requests for status, count in sorted(entry['statuses'].items(), key=str)])
+        histogram('emlgo_http_request_seconds', 'Latency of HTTP requests to the Gophish server.',
+                  [({'method': method, 'endpoint': endpoint}, entry['latency']) for (method, endpoint), entry in requests])
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """A table of the stages, file latencies, bytes and HTTP requests, for the terminal."""
+        lines = [f"{'stage':<20} {'calls':>8} {'wall s':>10} {'cpu s':>10}"]
+        for name, (calls, wall, cpu) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<20} {calls:>8} {wall:>10.3f} {cpu:>10.3f}")
+        if self.files.count:
+            files = self.files
+            lines.append(f"\nfiles: {files.count}, mean {files.sum / files.count * 1000:.1f} ms, "
+                         f"p50 <= {files.quantile(0.5) * 1000:.1f} ms, p90 <= {files.quantile(0.9) * 1000:.1f} ms, "
+                         f"p99 <= {files.quantile(0.99) * 1000:.1f} ms, max {files.max * 1000:.1f} ms")
+        lines.append(f"bytes read: {self.bytes_read}, bytes written: {self.bytes_written}")
+        if self.requests:
+            lines.append(f"\n{'request':<40} {'count':>6} {'errors':>6} {'mean ms':>9} {'p90 ms':>9}")
+            for (method, endpoint), entry in sorted(self.requests.items()):
+                latency = entry['latency']
+                errors = sum(count for status, count in entry['statuses'].items()
+                             if not isinstance(status, int) or status >= 400)
+                lines.append(f"{method + ' ' + endpoint:<40} {latency.count:>6} {errors:>6} "
+                             f"{latency.sum / latency.count * 1000:>9.1f} {latency.quantile(0.9) * 1000:>9.1f}")
+        if self.slowest:
+            lines.append("\nslowest files:")
+            for seconds, file, _ in sorted(self.slowest, reverse=True):
+                lines.append(f"  {seconds * 1000:>9.1f} ms  {file}")
+        lines.append(f"\ntotal: {time.perf_counter() - self.started:.3f} s")
+        return '\n'.join(lines)
+
+    def save(self, path):
+        """Write the metrics as a Prometheus textfile if path ends with .prom, as JSON otherwise."""
+        with open(path, 'w', encoding='utf-8') as file:
+            if path.endswith('.prom'):
+                file.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), file, indent=2)
+                file.write('\n')
+
+    def dump_profiles(self, directory):
+        """Write the cProfile stats of the slowest files as .prof files (readable with pstats); return their paths."""
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        profiled = [entry for entry in sorted(self.slowest, reverse=True) if entry[2] is not None]
+        for rank, (seconds, file, profile) in enumerate(profiled, start=1):
+            path = os.path.join(directory, f"slowest-{rank:02d}-{os.path.basename(file)}.prof")
+            with open(path, 'wb') as output:
+                output.write(profile)
+            paths.append(path)
+        return paths
+
+def enable(metrics=None):
+    """Start recording into metrics (a new Metrics if None) and return it."""
+    global _metrics
+    _metrics = metrics if metrics is not None else Metrics()
+    return _metrics
+
+def disable():
+    global _metrics
+    _metrics = None
+
+def current():
+    """The Metrics being recorded into, or None."""
+    return _metrics
+
+def stage(name):
+    """Context manager timing a stage; does nothing when metrics are off."""
+    if _metrics is None:
+        return contextlib.nullcontext()
+    return _metrics.stage(name)
+
+def add_bytes(read=0, written=0):
+    if _metrics is not None:
+        with _lock:
+            _metrics.bytes_read += read
+            _metrics.bytes_written += written
+
+def record_request(method, path, status, seconds):
+    if _metrics is not None:
+        _metrics.record_request(method, path, status, seconds)
+
+def measure_file(func, file, profile=False):
+    """
+    Run func(file) recording into a fresh Metrics and return (result, metrics).
+
+    Used by emlgolib.run_on_files in the process that does the work, so that
+    the parent can merge what each file cost. With profile=True the call runs
+    under cProfile and its stats are attached to the file's latency.
+    """
+    global _metrics
+    previous, metrics = _metrics, Metrics(slowest=1)
+    _metrics = metrics
+    try:
+        start = time.perf_counter()
+        if profile:
+            import cProfile
+            import pstats
+            profiler = cProfile.Profile()
+            result = profiler.runcall(func, file)
+            seconds = time.perf_counter() - start
+            metrics.record_file(str(file), seconds, marshal.dumps(pstats.Stats(profiler).stats))
+        else:
+            result = func(file)
+            metrics.record_file(str(file), time.perf_counter() - start)
+        return result, metrics
+    finally:
+        _metrics = previous
@@ -0,0 +1,368 @@
+"""
+Watch mode: turn the .eml files that land in a directory into templates and publish them.
+
+Changes are read from inotify on Linux, or by polling the directory tree
+elsewhere. A file is converted once it has not changed for `debounce`
+seconds, by the same transformation as gophishing_everything and through
+the same manifest, so files that did not really change are skipped and a
+later `-all` does not convert them again. Only the templates of the files
+just converted are sent to the server.
+"""
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import signal
+import struct
+import threading
+import time
+
+import emlgolib
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+event_header = struct.Struct('iIII')
+
+# Seconds between two saves of the manifest while files keep coming
+MANIFEST_SAVE_INTERVAL = 5.0
+
+class InotifyWatcher:
+    """
+    Report the .eml files written or moved into a directory tree, through inotify.
+
+    Every directory of the tree gets a watch, and new directories are
+    watched as they appear. If the kernel queue overflows, the whole tree is
+    reported once so that nothing is missed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.paths = {}
+        try:
+            self._watch_tree(directory)  # the files already there are not changes
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"Cannot watch {path}: {os.strerror(error)}")
+        self.paths[wd] = path
+
+    def _watch_tree(self, directory):
+        """Watch directory and its subdirectories and return the .eml files already in them."""
+        eml_files = []
+        for root, dirs, files in os.walk(directory):
+            self._watch(root)
+            eml_files.extend(os.path.join(root, name) for name in files if name.endswith('.eml'))
+        return eml_files
+
+    def changes(self, timeout):
+        """Wait up to timeout seconds and return the .eml files written since the last call."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = event_header.unpack_from(data, offset)
+            offset += event_header.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                print("Too many changes at once, looking at the whole directory again")
+                changed.extend(emlgolib.find_eml_files(self.directory))
+                continue
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+            directory = self.paths.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path):
+                    # Files may have landed before the watch was added
+                    changed.extend(self._watch_tree(path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and name.endswith('.eml'):
+                changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """
+    Report the .eml files created or modified in a directory tree, by polling.
+
+    Only the directories whose mtime changed are listed again; the known
+    .eml files are checked with one stat() each.
+    """
+
+    def __init__(self, directory, interval=2.0):
+        self.interval = interval
+        self.directories = {}
+        self.files = {}
+        self.next_poll = time.monotonic() + interval
+        self._scan_directory(directory)
+        # the files already there are not changes
+        self._changed_files()
+
+    def _scan_directory(self, directory):
+        """Remember the subdirectories and .eml files of directory; new files have no version yet."""
+        try:
+            self.directories[directory] = os.stat(directory).st_mtime_ns
+            entries = list(os.scandir(directory))
+        except OSError:
+            self.directories.pop(directory, None)
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.path not in self.directories:
+                    self._scan_directory(entry.path)
+            elif entry.name.endswith('.eml') and entry.path not in self.files:
+                self.files[entry.path] = None
+
+    def changes(self, timeout):
+        """Wait up to timeout seconds and return the .eml files that changed since the last poll."""
+        wait = self.next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        self.next_poll = time.monotonic() + self.interval
+
+        for directory, mtime in list(self.directories.items()):
+            try:
+                if os.stat(directory).st_mtime_ns == mtime:
+                    continue
+            except OSError:
+                self.directories.pop(directory)
+                continue
+            self._scan_directory(directory)
+        return self._changed_files()
+
+    def _changed_files(self):
+        changed = []
+        for path, version in list(self.files.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.files[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != version:
+                self.files[path] = (stat.st_size, stat.st_mtime_ns)
+                changed.append(path)
+        return changed
+
+    def close(self):
+        pass
+
+def make_watcher(directory, poll_interval=None):
+    """An InotifyWatcher, or a PollingWatcher if poll_interval is given or inotify is not available."""
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            print(f"inotify is not available ({e}), polling every 2 seconds instead")
+            poll_interval = 2.0
+    return PollingWatcher(directory, poll_interval)
+
+class Debouncer:
+    """
+    Hold changed paths until they have been quiet for `delay` seconds.
+
+    Paths are kept in the order they last changed, so the ready ones are
+    always at the front and taking them does not look at the others.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.pending = {}
+
+    def touch(self, paths, now=None):
+        now = time.monotonic() if now is None else now
+        for path in paths:
+            self.pending.pop(path, None)
+            self.pending[path] = now
+
+    def pop_ready(self, limit, now=None):
+        """Remove and return up to limit paths that have been quiet long enough, oldest first."""
+        now = time.monotonic() if now is None else now
+        ready = []
+        for path, changed in self.pending.items():
+            if len(ready) >= limit or now - changed < self.delay:
+                break
+            ready.append(path)
+        for path in ready:
+            del self.pending[path]
+        return ready
+
+    def has_ready(self, now=None):
+        now = time.monotonic() if now is None else now
+        for changed in self.pending.values():
+            return now - changed >= self.delay
+        return False
+
+def _init_worker(*initargs):
+    # Ctrl-C reaches the whole process group: the daemon stops the pool itself once the queue is done
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    emlgolib._init_gophish_worker(*initargs)
+
+class WatchDaemon:
+    """
+    Convert the .eml files of a directory as they arrive and publish their templates.
+
+    The main thread watches the directory and moves the files that stopped
+    changing into a queue of at most queue_size files; while it is full they
+    wait in the debouncer, each path only once. A worker thread takes the
+    queued files in batches, converts the ones the manifest says are stale
+    (on a pool of `jobs` processes kept for the whole run) and publishes
+    their templates with manager, if any. On SIGINT or SIGTERM watching
+    stops, the files already queued are converted and published, and the
+    manifest is saved; after a second signal only the files being converted
+    are finished, published and saved, and the rest wait for the next run.
+    """
+
+    def __init__(self, directory, names=None, jobs=1, sanitizer='stream', strip_handlers=True, assets=None,
+                 manager=None, debounce=2.0, queue_size=100, poll_interval=None):
+        self.directory = directory
+        self.jobs = jobs
+        self.initargs = (names, sanitizer, strip_handlers, assets)
+        self.manager = manager
+        self.debouncer = Debouncer(debounce)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+        self.forced = threading.Event()
+        self.saved = time.monotonic()
+        self.manifest = emlgolib.BuildManifest(directory, emlgolib.gophish_settings(names, sanitizer, strip_handlers,
+                                                                                    assets=assets))
+
+    def stop(self, *args):
+        if self.stopping.is_set():
+            # A second Ctrl-C does not wait for the queue, but still lets run() clean up
+            if not self.forced.is_set():
+                print("Stopping now, the remaining files will be converted on the next run")
+                self.forced.set()
+            return
+        print("Stopping: finishing the files already queued, Ctrl-C again to quit now")
+        self.stopping.set()
+
+    def run(self):
+        watcher = make_watcher(self.directory, self.poll_interval)
+        # Files that arrived while nothing was watching; the manifest skips the others
+        self.debouncer.touch(emlgolib.find_eml_files(self.directory), now=float('-inf'))
+        previous_handlers = {number: signal.signal(number, self.stop) for number in (signal.SIGINT, signal.SIGTERM)}
+        worker = threading.Thread(target=self._work, name='emlgo-watch-worker', daemon=True)
+        worker.start()
+        print(f"Watching {self.directory}, press Ctrl-C to stop")
+        try:
+            while not self.stopping.is_set():
+                # Only this thread puts, so the free space can only grow until the next put
+                for path in self.debouncer.pop_ready(self.queue.maxsize - self.queue.qsize()):
+                    self.queue.put_nowait(path)
+                # Come back soon when files are only waiting for room in the queue
+                self.debouncer.touch(watcher.changes(0.05 if self.debouncer.has_ready() else 0.5))
+        finally:
+            self.stopping.set()
+            self.queue.put(None)
+            worker.join()
+            watcher.close()
+            for number, handler in previous_handlers.items():
+                signal.signal(number, handler)
+
+    def _batches(self):
+        """Yield the queued files in batches, until the None put by run() on shutdown."""
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < self.queue.maxsize:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = batch[-1] is None
+            batch = [path for path in dict.fromkeys(batch) if path is not None]
+            if batch:
+                yield batch
+            if done:
+                return
+
+    def _work(self):
+        executor = None
+        if self.jobs > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker, initargs=self.initargs)
+        else:
+            emlgolib._init_gophish_worker(*self.initargs)
+        try:
+            for batch in self._batches():
+                if self.forced.is_set():
+                    # Only drain the queue, so that run() can put the final None
+                    continue
+                try:
+                    self._convert_and_publish(batch, executor)
+                except Exception as e:
+                    print(f"Error processing {len(batch)} files: {e}")
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=self.forced.is_set())
+            self.manifest.save()
+
+    def _convert_and_publish(self, batch, executor):
+        stale_files = [path for path in batch if os.path.exists(path) and self.manifest.is_stale(path)]
+        if not stale_files:
+            return
+        output_files = []
+        for file, output_file, error in emlgolib.run_on_files(emlgolib._gophish_worker, stale_files, self.jobs,
+                                                              executor=executor):
+            if error:
+                print(f"Error converting {file}: {error}")
+            else:
+                self.manifest.record(file, output_file)
+                output_files.append(output_file)
+            if self.forced.is_set():
+                break
+        # Saving writes the whole manifest: not after every batch of a large backlog
+        if time.monotonic() - self.saved > MANIFEST_SAVE_INTERVAL:
+            self.manifest.save()
+            self.saved = time.monotonic()
+        message = f"{len(output_files)} files converted"
+        if self.manager is not None and output_files:
+            results = self.manager.publish_templates(output_files)
+            if results is not None:
+                message += ", templates " + ", ".join(f"{len(results[action])} {action}" for action in results
+                                                      if results[action])
+        print(message)
+
+def watch(directory, names=None, jobs=1, sanitizer='stream', strip_handlers=True, assets=None, manager=None,
+          debounce=2.0, queue_size=100, poll_interval=None):
+    try:
+        WatchDaemon(directory, names, jobs, sanitizer, strip_handlers, assets, manager, debounce, queue_size,
+                    poll_interval).run()
+    except KeyboardInterrupt:
+        print("Stopped before the queue was done, the remaining files will be converted on the next run")